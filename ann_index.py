@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import numpy as np
+from document_store import DocumentStore
+from vector_index import normalize_rows, recall_baseline
+
+
+logger = logging.getLogger(__name__)
+
+class IVFIndex:
+    """Inverted-file approximate nearest neighbour index
+
+    Vectors are clustered with spherical k-means into `nlist` cells. A query
+    only scores the rows in the `nprobe` cells whose centroids are closest to
+    it, which trades a little recall for a large cut in work per query.
+    """
+
+    def __init__(self, dim, nlist=0, nprobe=8):
+        self.dim = dim
+        self.nlist = nlist  # 0 picks a size from the corpus when training
+        self.nprobe = nprobe
+        self.centroids = None
+        self.lists = []  # cell -> array of row ids
+        self.num_rows = 0  # rows [0, num_rows) have been added
+        self.trained_rows = 0
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def train(self, vectors, iterations=10, max_sample=100000, seed=0):
+        """Learn cell centroids from a sample of the vectors"""
+        nlist = self.nlist or max(1, int(4 * np.sqrt(len(vectors))))
+        nlist = min(nlist, len(vectors))
+
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(vectors), max_sample, nlist * 256)
+        sample_rows = np.sort(rng.choice(len(vectors), sample_size, replace=False))
+        sample = normalize_rows(vectors[sample_rows])
+
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = self._assign(sample, centroids)
+            counts = np.bincount(assignments, minlength=nlist)
+
+            # Sum the members of each cell in one pass over the sorted sample
+            order = np.argsort(assignments, kind="stable")
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            sums = np.zeros_like(centroids)
+            sums[counts > 0] = np.add.reduceat(sample[order], starts[counts > 0], axis=0)
+
+            # Reseed empty cells with random sample points
+            empty = counts == 0
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = normalize_rows(sums)
+
+        self.centroids = centroids
+        self.lists = [np.zeros(0, dtype=np.int64) for _ in range(nlist)]
+        self.num_rows = 0
+        self.trained_rows = len(vectors)
+
+    @staticmethod
+    def _assign(vectors, centroids, chunk_rows=65536):
+        """Return the index of the closest centroid for every vector"""
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk_rows):
+            chunk = vectors[start:start + chunk_rows]
+            assignments[start:start + chunk_rows] = np.argmax(chunk @ centroids.T, axis=1)
+        return assignments
+
+    def add(self, vectors, start):
+        """Add rows [start, start + len(vectors)) to their closest cells"""
+        if len(vectors) == 0:
+            return
+        assignments = self._assign(vectors, self.centroids)
+        rows = np.arange(start, start + len(vectors))
+        for cell in np.unique(assignments):
+            self.lists[cell] = np.concatenate([self.lists[cell], rows[assignments == cell]])
+        self.num_rows = max(self.num_rows, start + len(vectors))
+
+    def candidates(self, query, nprobe=None):
+        """Return the row ids stored in the cells closest to the query"""
+        nprobe = min(nprobe or self.nprobe, len(self.lists))
+        cell_scores = self.centroids @ query
+        cells = np.argpartition(-cell_scores, nprobe - 1)[:nprobe]
+        rows = np.concatenate([self.lists[cell] for cell in cells])
+        # Sorted rows read the underlying matrix in file order
+        rows.sort()
+        return rows
+
+    def save(self, path):
+        """Write the index to a .npz file, replacing it in one step"""
+        sizes = np.array([len(rows) for rows in self.lists], dtype=np.int64)
+        # One temporary file per process, so concurrent writers never share one
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, sizes=sizes,
+                 rows=np.concatenate(self.lists) if self.lists else np.zeros(0, dtype=np.int64),
+                 num_rows=self.num_rows, trained_rows=self.trained_rows,
+                 nlist=self.nlist)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, nprobe=8):
+        """Read an index written by save(), or return None if there isn't a readable one
+
+        A damaged file is reported and ignored, so the index gets rebuilt.
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                index = cls(data["centroids"].shape[1], nlist=int(data["nlist"]), nprobe=nprobe)
+                index.centroids = data["centroids"]
+                index.lists = np.split(data["rows"], np.cumsum(data["sizes"])[:-1])
+                index.num_rows = int(data["num_rows"])
+                index.trained_rows = int(data["trained_rows"])
+        except Exception as e:
+            logger.warning("Could not read ANN index %s, it will be rebuilt: %s", path, e)
+            return None
+        return index
+
+
+def recall_report(vectors, nprobes=(1, 2, 4, 8, 16, 32), num_queries=200, k=10, nlist=0, seed=0):
+    """Compare IVF recall@k and latency against exact search (see vector_index.recall_baseline)"""
+    queries, exact_results, exact_ms = recall_baseline(vectors, num_queries, k, seed)
+    k = min(k, len(vectors))
+
+    start = time.perf_counter()
+    index = IVFIndex(vectors.shape[1], nlist=nlist)
+    index.train(vectors)
+    index.add(vectors, 0)
+    print(f"Trained {len(index.lists)} cells over {len(vectors)} vectors "
+          f"in {time.perf_counter() - start:.2f}s")
+
+    print(f"{'mode':>10} {'recall@' + str(k):>10} {'ms/query':>10} {'scored':>10}")
+    print(f"{'exact':>10} {1.0:>10.3f} {exact_ms:>10.2f} {len(vectors):>10}")
+
+    for nprobe in nprobes:
+        hits = 0
+        scored = 0
+        start = time.perf_counter()
+        for query, expected in zip(queries, exact_results):
+            rows = index.candidates(query, nprobe)
+            scores = vectors[rows] @ query
+            top = rows[np.argpartition(-scores, min(k, len(rows)) - 1)[:k]]
+            hits += len(expected & set(top.tolist()))
+            scored += len(rows)
+        ms = (time.perf_counter() - start) * 1000 / len(queries)
+        print(f"{'nprobe=' + str(nprobe):>10} {hits / (k * len(queries)):>10.3f} "
+              f"{ms:>10.2f} {scored // len(queries):>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IVF recall vs latency report for a document store")
+    parser.add_argument("store_dir", help="store directory, e.g. document_data/sentence-transformers--all-MiniLM-L6-v2")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    with open(os.path.join(args.store_dir, "catalog.json"), "r", encoding="utf-8") as f:
+        dim = json.load(f)["dim"]
+    store_vectors = DocumentStore(args.store_dir, dim).embeddings()
+    if len(store_vectors) == 0:
+        sys.exit("The store has no embeddings yet")
+    recall_report(store_vectors, args.nprobe, args.queries, args.k, args.nlist)
@@ -79,11 +79,20 @@
 # if __name__ == '__main__':
 #     app.run(debug=True)
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
 import os
+import sys
+import json
+import time
 import uuid
+import queue
+import subprocess
 from werkzeug.utils import secure_filename
-from chatbot import DocumentChatbot
+from chatbot import DocumentChatbot, configure_logging
+from jobs import IngestionQueue
+from metrics import Registry
+
+configure_logging()
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
@@ -95,6 +104,68 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 # Initialize chatbot
 chatbot = DocumentChatbot()
 
+# Under gunicorn --preload, gunicorn.conf.py starts the warm-up in each worker instead
+if os.environ.get('PRELOAD_APP') != '1':
+    chatbot.start_warmup()
+
+# Uploads are processed in the background by a small, bounded worker pool
+ingestion_queue = IngestionQueue(
+    chatbot,
+    workers=int(os.environ.get('INGEST_WORKERS', 1)),
+    max_pending=int(os.environ.get('INGEST_QUEUE_SIZE', 16)),
+    # Shared with the other gunicorn workers, which may be asked about the job
+    status_dir=os.path.join(chatbot.data_dir, 'jobs')
+)
+
+# Request counts and latencies, exported at /metrics with the chatbot's own
+request_seconds = chatbot.metrics.histogram(
+    'http_request_duration_seconds',
+    'Time to handle a request (for streamed answers, until the response starts)',
+    labels=('method', 'endpoint'))
+requests_total = chatbot.metrics.counter(
+    'http_requests_total', 'Requests handled, by status code', labels=('method', 'endpoint', 'status'))
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    request_seconds.observe(time.perf_counter() - g.request_started, method=request.method, endpoint=endpoint)
+    requests_total.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+    # Let the other workers' /metrics see this worker's numbers
+    chatbot.metrics.sync()
+    return response
+
+def save_upload(file):
+    """Save an uploaded file under a name no other upload has; returns (file_path, filename)
+
+    Two uploads with the same name would otherwise overwrite each other on
+    disk, even while the first is still queued. filename is the name the
+    document is shown under.
+    """
+    filename = secure_filename(file.filename)
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], f'{uuid.uuid4().hex}_{filename}')
+    try:
+        file.save(file_path)
+    except Exception:
+        remove_uploads([file_path])
+        raise
+    return file_path, filename
+
+def remove_uploads(file_paths):
+    """Delete saved uploads that won't be processed
+
+    Left in the upload folder, they would be indexed by the next startup
+    ingestion although the client was told the upload failed.
+    """
+    for file_path in file_paths:
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
 @app.route('/')
 def home():
     return render_template('index.html')
@@ -113,33 +184,104 @@ def upload_document():
     if not file.filename.lower().endswith('.pdf'):
         return jsonify({'error': 'Only PDF files are supported'}), 400
         
+    file_paths = []
     try:
         # Save the file
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-                
-        # Process the document with chatbot
-        doc_id = chatbot.process_document(file_path, filename)
-                
-        if doc_id:
-            return jsonify({
-                'success': True,
-                'doc_id': doc_id,
-                'filename': filename
-            })
-        else:
-            return jsonify({'error': 'Failed to process document'}), 500
-                
+        file_path, filename = save_upload(file)
+        file_paths.append(file_path)
+
+        # Queue the document for processing; the client polls /api/jobs/<job_id>
+        job_id = ingestion_queue.submit(file_path, filename)
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'filename': filename
+        }), 202
+
+    except queue.Full:
+        remove_uploads(file_paths)
+        return jsonify({'error': 'Too many documents are being processed, please try again later'}), 429
     except Exception as e:
+        remove_uploads(file_paths)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/upload-documents', methods=['POST'])
+def upload_documents():
+    """Handle the upload of several documents, processed together as one job"""
+    files = [file for file in request.files.getlist('files') if file.filename]
+    if not files:
+        return jsonify({'error': 'No selected files'}), 400
+
+    if any(not file.filename.lower().endswith('.pdf') for file in files):
+        return jsonify({'error': 'Only PDF files are supported'}), 400
+
+    filenames = []
+    file_paths = []
+    try:
+        for file in files:
+            file_path, filename = save_upload(file)
+            filenames.append(filename)
+            file_paths.append(file_path)
+
+        job_id = ingestion_queue.submit_batch(file_paths, filenames)
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'filenames': filenames
+        }), 202
+
+    except queue.Full:
+        remove_uploads(file_paths)
+        return jsonify({'error': 'Too many documents are being processed, please try again later'}), 429
+    except Exception as e:
+        remove_uploads(file_paths)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Report the stage and progress of a document processing job"""
+    job = ingestion_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job)
+
 @app.route('/api/documents', methods=['GET'])
 def list_documents():
     """Get list of loaded documents"""
     documents = chatbot.list_documents()
     return jsonify(documents)
 
+@app.route('/api/documents/<doc_id>', methods=['DELETE'])
+def delete_document(doc_id):
+    """Remove a document so it is no longer searched"""
+    try:
+        if not chatbot.delete_document(doc_id):
+            return jsonify({'error': 'Unknown document'}), 404
+        return jsonify({'success': True, 'doc_id': doc_id})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    """Report that the server is up, whether or not it is ready yet"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    """Report whether the model and index are ready; 503 until they are"""
+    readiness = chatbot.readiness()
+    return jsonify(readiness), 200 if readiness['ready'] else 503
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    """Report cache hit rates and batching statistics"""
+    return jsonify(chatbot.stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Report stage timings and request counters of all workers in the Prometheus text format"""
+    return Response(chatbot.metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/ask', methods=['POST'])
 def ask_question():
     """Process a question and return answer"""
@@ -157,6 +299,35 @@ def ask_question():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/ask-stream', methods=['POST'])
+def ask_question_stream():
+    """Answer a question as Server-Sent Events: sources as they are found, then the answer"""
+    data = request.json
+
+    if not data or 'question' not in data:
+        return jsonify({'error': 'No question provided'}), 400
+
+    question = data['question']
+    doc_ids = data.get('doc_ids', None)  # Optional parameter
+
+    def events():
+        try:
+            for event, payload in chatbot.stream_answer(question, doc_ids):
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Keep proxies such as nginx from buffering the stream
+        'X-Accel-Buffering': 'no'
+    })
+
 if __name__ == '__main__':
+    # Index PDFs already in the upload folder in a separate process, so the
+    # server answers while they are processed
+    Registry.reset(chatbot.metrics.directory)
+    if os.environ.get('INGEST_UPLOADS', '1') == '1':
+        subprocess.Popen([sys.executable, '-m', 'chatbot', 'ingest', app.config['UPLOAD_FOLDER']])
     # In Docker, we should listen on 0.0.0.0
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,96 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent single-text embedding requests into batched forward passes
+
+    Each caller of encode() hands its text to a background thread, which
+    gathers whatever other requests arrive within `max_wait_ms` (up to
+    `max_batch_size` texts), embeds them with one call to `encode_batch` and
+    hands every caller its own row. A request that arrives while no one else
+    is waiting is encoded straight away, so a single user never pays the wait.
+    """
+
+    def __init__(self, encode_batch, max_batch_size=32, max_wait_ms=5):
+        self.encode_batch = encode_batch  # list of texts -> (n, dim) array
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self.lock = threading.Lock()
+        self.active = 0  # callers currently inside encode()
+        self.pending = None
+        self.thread = None
+        self.pid = None
+
+        self.batches = 0
+        self.requests = 0
+
+    def _ensure_thread(self):
+        """Start the batching thread, again in a forked child that lost it"""
+        if self.thread is None or self.pid != os.getpid():
+            self.pending = queue.Queue()
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+            self.thread.start()
+
+    def encode(self, text):
+        """Return the embedding of one text as a (dim,) array"""
+        if self.max_batch_size <= 1:
+            return self.encode_batch([text])[0]
+
+        future = Future()
+        with self.lock:
+            self._ensure_thread()
+            self.active += 1
+            self.pending.put((text, future))
+        try:
+            return future.result()
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def _collect(self):
+        """Wait for one request, then gather more until the batch is full or the wait is over"""
+        batch = [self.pending.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self.pending.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+
+            # Only wait if other callers are on their way
+            remaining = deadline - time.monotonic()
+            if self.active <= len(batch) or remaining <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self.batches += 1
+            self.requests += len(batch)
+            try:
+                embeddings = self.encode_batch([text for text, _ in batch])
+                for (_, future), embedding in zip(batch, embeddings):
+                    future.set_result(embedding)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+    def stats(self):
+        """Return how many requests were served and in how many batches"""
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0
+        }
@@ -0,0 +1,279 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import threading
+import numpy as np
+
+
+# Words every document uses, so questions and descriptors aren't all unknown tokens
+COMMON_WORDS = """
+the a an of to in and or is are was be this that it for on with as by at from what which
+how why when who document about page section figure table results method data model
+""".split()
+
+
+def make_vocabulary(size, rng):
+    """Return `size` distinct made-up lowercase words"""
+    syllables = [c + v for c in "bcdfghklmnprstvz" for v in "aeiou"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables, rng.integers(2, 5))))
+    return sorted(words)
+
+
+def make_sentences(vocabulary, count, rng):
+    """Return sentences of 8-25 words, common words being picked far more often (Zipf-like)"""
+    words = COMMON_WORDS + vocabulary
+    weights = 1.0 / np.arange(1, len(words) + 1)
+    weights /= weights.sum()
+    lengths = rng.integers(8, 26, count)
+    picked = rng.choice(len(words), lengths.sum(), p=weights)
+    sentences = []
+    for end, length in zip(np.cumsum(lengths), lengths):
+        sentence = " ".join(words[i] for i in picked[end - length:end])
+        sentences.append(sentence[0].upper() + sentence[1:] + ".")
+    return sentences
+
+
+def write_pdf(path, pages, line_length=90):
+    """Write an uncompressed PDF with one page of Helvetica text per string in pages"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        lines, line = [], ""
+        for word in text.split():
+            if line and len(line) + len(word) >= line_length:
+                lines.append(line)
+                line = ""
+            line = f"{line} {word}" if line else word
+        lines.append(line)
+        escaped = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines]
+        stream = ("BT /F1 10 Tf 12 TL 50 760 Td " + " T* ".join(f"({line}) Tj" for line in escaped)
+                  + " ET").encode("latin-1", "replace")
+
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects)))
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), len(kids))
+
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def make_corpus(directory, first, count, pages, sentences_per_page, vocabulary, rng):
+    """Write synthetic PDFs bench-<first>.pdf onwards; returns (paths, sentences)"""
+    os.makedirs(directory, exist_ok=True)
+    paths, all_sentences = [], []
+    for number in range(first, first + count):
+        sentences = make_sentences(vocabulary, pages * sentences_per_page, rng)
+        path = os.path.join(directory, f"bench-{number:05d}.pdf")
+        write_pdf(path, [" ".join(sentences[start:start + sentences_per_page])
+                         for start in range(0, len(sentences), sentences_per_page)])
+        paths.append(path)
+        all_sentences.extend(sentences)
+    return paths, all_sentences
+
+
+def make_questions(sentences, count, rng):
+    """Turn random sentences into questions by dropping a third of their words"""
+    questions = []
+    for i in rng.choice(len(sentences), count, replace=len(sentences) < count):
+        words = sentences[i].rstrip(".").split()
+        keep = np.sort(rng.choice(len(words), len(words) - len(words) // 3, replace=False))
+        questions.append(" ".join(words[j] for j in keep) + "?")
+    return questions
+
+
+def build_stand_in_model(directory, vocabulary, hidden_size=64, layers=2):
+    """Save a small randomly initialized BERT with a tokenizer for the synthetic words
+
+    It runs through the same tokenizer, encoder and index code as the real
+    model, only much faster, and needs no download. Its embeddings carry no
+    meaning, so it measures speed, not answer quality.
+    """
+    if os.path.exists(os.path.join(directory, "config.json")):
+        return
+    import torch
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    os.makedirs(directory, exist_ok=True)
+    tokens = (["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + list(".,;:?!()-'\"/%")
+              + [str(digit) for digit in range(10)] + sorted(set(COMMON_WORDS + vocabulary)))
+    vocab_path = os.path.join(directory, "vocab.txt")
+    with open(vocab_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(tokens) + "\n")
+    BertTokenizerFast(vocab_file=vocab_path, do_lower_case=True).save_pretrained(directory)
+
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=len(tokens), hidden_size=hidden_size, num_hidden_layers=layers,
+                        num_attention_heads=2, intermediate_size=4 * hidden_size)
+    BertModel(config).save_pretrained(directory)
+
+
+def percentiles(latencies):
+    """Return the p50, p95 and p99 of latencies in milliseconds"""
+    return np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+
+
+def measure_pipeline(chatbot, paths):
+    """Time extraction, segmentation and embedding of some PDFs, one stage after another
+
+    Returns the throughput of each stage: pages/s, sentences/s and rows/s.
+    """
+    from chatbot import iter_page_range
+    import PyPDF2
+
+    start = time.perf_counter()
+    documents = []
+    for path in paths:
+        with open(path, "rb") as f:
+            num_pages = len(PyPDF2.PdfReader(f).pages)
+        documents.append((path, list(iter_page_range(path, 0, num_pages))))
+    extract_seconds = time.perf_counter() - start
+    num_pages = sum(len(pages) for _, pages in documents)
+
+    start = time.perf_counter()
+    texts = []
+    num_sentences = 0
+    for path, pages in documents:
+        segments = list(chatbot.tokenizer_tool.iter_sentences(pages))
+        num_sentences += len(segments)
+        rows = chatbot._iter_rows(chatbot._descriptors(os.path.basename(path)), segments)
+        texts.extend(" ".join(sentences) for sentences, _, _ in rows)
+    split_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    chatbot.generate_embeddings(texts)
+    embed_seconds = time.perf_counter() - start
+
+    return {
+        "pages_per_second": num_pages / extract_seconds,
+        "sentences_per_second": num_sentences / split_seconds,
+        "rows_per_second": len(texts) / embed_seconds
+    }
+
+
+def measure_retrieval(chatbot, questions):
+    """Return searches per second over the whole corpus, question embedding excluded"""
+    embeddings = [chatbot._embed_question(question) for question in questions]
+    start = time.perf_counter()
+    for question, embedding in zip(questions, embeddings):
+        chatbot.search(question, embedding, k=10)
+    return len(questions) / (time.perf_counter() - start)
+
+
+def measure_ask(flask_app, questions, concurrency):
+    """POST every question to /api/ask from `concurrency` threads; returns (latencies, requests/s)"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(share):
+        client = flask_app.test_client()
+        for question in share:
+            start = time.perf_counter()
+            response = client.post("/api/ask", json={"question": question})
+            elapsed = time.perf_counter() - start
+            with lock:
+                (latencies if response.status_code == 200 else errors).append(elapsed)
+
+    threads = [threading.Thread(target=worker, args=(questions[i::concurrency],)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    if errors:
+        print(f"  {len(errors)} requests failed")
+    return latencies, len(latencies) / seconds
+
+
+def print_stage_summary(title, histogram):
+    """Print the mean and total time of each stage recorded in a histogram"""
+    print(title)
+    for (stage,), (count, total) in sorted(histogram.summary().items()):
+        print(f"  {stage:>8}: {count:>6} observations, {total / count * 1000:>10.2f} ms mean, {total:>8.2f} s total")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Ingestion throughput and /api/ask latency on synthetic PDFs, with a small offline model")
+    parser.add_argument("--documents", type=int, nargs="+", default=[10, 50],
+                        help="corpus sizes to measure, in documents (ascending)")
+    parser.add_argument("--pages", type=int, default=10, help="pages per document")
+    parser.add_argument("--sentences-per-page", type=int, default=30)
+    parser.add_argument("--vocabulary", type=int, default=5000, help="distinct made-up words")
+    parser.add_argument("--questions", type=int, default=200, help="questions per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--workdir", default=os.path.join("document_data", "benchmark"),
+                        help="where the PDFs, the model and the index are written (emptied first)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # The chatbot keeps its files under the working directory
+    shutil.rmtree(args.workdir, ignore_errors=True)
+    os.makedirs(args.workdir)
+    os.chdir(args.workdir)
+    rng = np.random.default_rng(args.seed)
+    vocabulary = make_vocabulary(args.vocabulary, rng)
+    build_stand_in_model("stand-in-model", vocabulary)
+
+    # Every question is answered from scratch rather than from a cache
+    os.environ.setdefault("MODEL_NAME", "stand-in-model")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("WARMUP", "0")
+    os.environ.setdefault("QUESTION_CACHE_SIZE", "0")
+    os.environ.setdefault("ANSWER_CACHE_SIZE", "0")
+    import app as server
+    chatbot = server.chatbot
+    chatbot.warmup()
+
+    corpus_sentences = []
+    for size in sorted(args.documents):
+        added = size - len(chatbot.documents)
+        if added <= 0:
+            continue
+        paths, sentences = make_corpus("uploads", len(chatbot.documents), added, args.pages,
+                                       args.sentences_per_page, vocabulary, rng)
+        corpus_sentences.extend(sentences)
+
+        print(f"\n{size} documents ({size * args.pages} pages, {len(corpus_sentences)} sentences)")
+        throughput = measure_pipeline(chatbot, paths)
+        print(f"  extract {throughput['pages_per_second']:.1f} pages/s, "
+              f"split {throughput['sentences_per_second']:.0f} sentences/s, "
+              f"embed {throughput['rows_per_second']:.0f} rows/s")
+
+        start = time.perf_counter()
+        doc_ids = chatbot.ingest_files(paths)
+        seconds = time.perf_counter() - start
+        if None in doc_ids:
+            sys.exit("Some synthetic documents could not be ingested")
+        print(f"  ingest_files {added / seconds:.2f} documents/s ({len(chatbot.index)} rows indexed)")
+
+        questions = make_questions(corpus_sentences, args.questions, rng)
+        print(f"  search ({chatbot.retrieval_mode}) {measure_retrieval(chatbot, questions):.0f} queries/s")
+
+        print(f"  {'clients':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for concurrency in args.concurrency:
+            latencies, requests_per_second = measure_ask(server.app, questions, concurrency)
+            p50, p95, p99 = percentiles(latencies)
+            print(f"  {concurrency:>8} {requests_per_second:>8.1f} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f}")
+
+    print()
+    print_stage_summary("Ingestion stages (per ingest_files run):", chatbot.ingest_stage_seconds)
+    print_stage_summary("Question stages (per question):", chatbot.query_stage_seconds)
@@ -0,0 +1,335 @@
+import os
+import re
+import json
+import math
+import uuid
+import bisect
+from collections import Counter
+import numpy as np
+
+
+# Terms too common to help find a sentence
+STOP_WORDS = frozenset("""
+a an and are as at be been but by can do does for from had has have how i if in
+into is it its me my no not of on or our so than that the their them then there
+these they this those to was we were what when where which who why will with you
+your
+""".split())
+
+
+class Vocabulary:
+    """Sorted terms packed back to back in one UTF-8 buffer, found by binary search
+
+    Unlike a dict it is two flat arrays, so it can be memory-mapped from a
+    file and shared by every process instead of unpickled by each.
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data  # uint8; term i is data[offsets[i]:offsets[i + 1]]
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, terms):
+        """Pack a sorted list of terms"""
+        encoded = [term.encode("utf-8") for term in terms]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, term_id):
+        return bytes(self.data[self.offsets[term_id]:self.offsets[term_id + 1]]).decode("utf-8")
+
+    def __iter__(self):
+        data = bytes(self.data)
+        bounds = self.offsets.tolist()
+        return (data[start:end].decode("utf-8") for start, end in zip(bounds, bounds[1:]))
+
+    def find(self, term):
+        """Return the id of a term, or None if it isn't in the vocabulary"""
+        # UTF-8 byte order is code point order, the order terms are sorted in
+        term_id = bisect.bisect_left(self, term)
+        if term_id < len(self) and self[term_id] == term:
+            return term_id
+        return None
+
+
+class Segment:
+    """Immutable postings for a contiguous range of rows
+
+    Postings are stored term after term in flat arrays, so a segment is a few
+    numpy arrays no matter how many terms it holds, two segments merge with a
+    handful of array operations, and a saved segment is memory-mapped rather
+    than read (see save() and open()).
+    """
+
+    def __init__(self, start, num_rows, terms, offsets, rows, frequencies, file=None):
+        self.start = start  # first row covered
+        self.num_rows = num_rows
+        self.terms = terms  # Vocabulary; a term's id is its position
+        self.offsets = offsets  # term id -> start of its postings, plus the end
+        self.rows = rows  # relative to start; grouped by term, ascending within a term
+        self.frequencies = frequencies
+        self.file = file  # name of the file it was saved to, if any
+
+    @classmethod
+    def build(cls, start, num_rows, terms, term_ids, rows, frequencies):
+        """Make a segment from postings listed in row order, terms mapping term -> id in term_ids"""
+        vocabulary = sorted(terms)
+        sorted_ids = np.zeros(len(terms), dtype=np.int64)
+        sorted_ids[[terms[term] for term in vocabulary]] = np.arange(len(vocabulary))
+        term_ids = sorted_ids[np.asarray(term_ids, dtype=np.int64)]
+        order = np.argsort(term_ids, kind="stable")
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=offsets[1:])
+        return cls(start, num_rows, Vocabulary.build(vocabulary), offsets,
+                   np.asarray(rows, dtype=np.int32)[order],
+                   np.asarray(frequencies, dtype=np.int32)[order])
+
+    def save(self, path):
+        """Write the arrays back to back; returns the counts open() needs to map them"""
+        with open(path, "wb") as f:
+            for array, dtype in ((self.offsets, np.int64), (self.terms.offsets, np.int64),
+                                 (self.rows, np.int32), (self.frequencies, np.int32),
+                                 (self.terms.data, np.uint8)):
+                np.asarray(array, dtype=dtype).tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        return {"num_terms": len(self.terms), "num_postings": self.size, "data_bytes": len(self.terms.data)}
+
+    @classmethod
+    def open(cls, directory, file, start, num_rows, num_terms, num_postings, data_bytes):
+        """Memory-map a segment written by save()"""
+        mapped = np.memmap(os.path.join(directory, file), dtype=np.uint8, mode="r")
+        arrays = []
+        position = 0
+        for dtype, count in ((np.int64, num_terms + 1), (np.int64, num_terms + 1),
+                             (np.int32, num_postings), (np.int32, num_postings), (np.uint8, data_bytes)):
+            end = position + count * np.dtype(dtype).itemsize
+            if end > len(mapped):
+                raise ValueError(f"Segment file {file} is truncated")
+            arrays.append(mapped[position:end].view(dtype))
+            position = end
+        offsets, term_offsets, rows, frequencies, data = arrays
+        return cls(start, num_rows, Vocabulary(data, term_offsets), offsets, rows, frequencies, file)
+
+    @property
+    def size(self):
+        return len(self.rows)
+
+    def postings(self, term):
+        """Return the (rows, frequencies) of a term, or None if no row contains it"""
+        term_id = self.terms.find(term)
+        if term_id is None:
+            return None
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.rows[start:end] + self.start, self.frequencies[start:end]
+
+    def term_ids(self):
+        """Return the term id of every posting"""
+        return np.repeat(np.arange(len(self.terms)), np.diff(self.offsets))
+
+    def merge(self, other):
+        """Return one segment covering this segment and the one right after it"""
+        terms = {term: term_id for term_id, term in enumerate(self.terms)}
+        for term in other.terms:
+            terms.setdefault(term, len(terms))
+        other_ids = np.array([terms[term] for term in other.terms], dtype=np.int64)
+
+        offset = other.start - self.start
+        return Segment.build(
+            self.start, offset + other.num_rows, terms,
+            np.concatenate([self.term_ids(), other_ids[other.term_ids()]]),
+            np.concatenate([self.rows, other.rows + offset]),
+            np.concatenate([self.frequencies, other.frequencies])
+        )
+
+
+class BM25Index:
+    """Inverted index over sentences with BM25 scoring
+
+    Every term maps to a postings list of the rows that contain it and how
+    often, using the same global row ids as the vector index. The store only
+    ever appends rows, so new rows go into a new segment of postings; the
+    newest segments are merged whenever they grow as large as the one before,
+    which keeps the number of segments logarithmic in the corpus size without
+    ever rewriting the whole index for one document.
+
+    Saved to a directory, the segments are memory-mapped by every process
+    sharing it, and saving again only writes the segments that are new.
+    """
+
+    TOKEN = re.compile(r'[^\W_]+')
+    MANIFEST = "manifest.json"
+    LENGTHS = "lengths.i32"
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.segments = ()  # oldest first
+        self.lengths = np.zeros(0, dtype=np.int32)  # row -> number of indexed terms
+        self.total_length = 0
+        self.saved_rows = 0  # rows whose lengths are in the directory saved to or opened
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @classmethod
+    def tokenize(cls, text):
+        """Split text into lowercase word and number terms, without stop words"""
+        return [term for term in cls.TOKEN.findall(text.lower()) if term not in STOP_WORDS]
+
+    def add(self, sentences):
+        """Index sentences as the next rows"""
+        terms = {}
+        term_ids, rows, frequencies = [], [], []
+        lengths = []
+        for row, sentence in enumerate(sentences):
+            sentence_terms = self.tokenize(sentence)
+            lengths.append(len(sentence_terms))
+            for term, frequency in Counter(sentence_terms).items():
+                term_ids.append(terms.setdefault(term, len(terms)))
+                rows.append(row)
+                frequencies.append(frequency)
+
+        segment = Segment.build(0, len(lengths), terms, term_ids, rows, frequencies)
+        self._append([segment], np.array(lengths, dtype=np.int32), len(self))
+
+    def extend(self, other, start):
+        """Add the index of a document whose rows begin at `start`"""
+        self._append(other.segments, other.lengths, start)
+
+    def _append(self, segments, lengths, start):
+        if start < len(self):
+            raise ValueError(f"Rows before {len(self)} are already indexed")
+
+        # Rows in between (if any) have no terms
+        all_lengths = np.concatenate([self.lengths, np.zeros(start - len(self), dtype=np.int32), lengths])
+        all_segments = list(self.segments)
+        for segment in segments:
+            all_segments.append(Segment(start + segment.start, segment.num_rows, segment.terms,
+                                        segment.offsets, segment.rows, segment.frequencies))
+            while len(all_segments) > 1 and all_segments[-2].size <= 2 * all_segments[-1].size:
+                last = all_segments.pop()
+                all_segments[-1] = all_segments[-1].merge(last)
+
+        # Searches read segments before lengths, so publishing lengths first
+        # means they never see a row they can't look up
+        self.total_length += int(lengths.sum())
+        self.lengths = all_lengths
+        self.segments = tuple(all_segments)
+
+    def scores(self, query):
+        """Return (rows, scores) for every row containing a query term, rows ascending"""
+        segments = self.segments
+        lengths = self.lengths
+        num_rows = len(lengths)
+        terms = set(self.tokenize(query))
+
+        # Gather each term's postings across segments
+        term_postings = {}
+        for segment in segments:
+            for term in terms:
+                postings = segment.postings(term)
+                if postings is not None:
+                    term_postings.setdefault(term, []).append(postings)
+
+        matched_rows = []
+        matched_scores = []
+        average_length = max(self.total_length / num_rows, 1.0) if num_rows else 1.0
+        for term, parts in term_postings.items():
+            rows = np.concatenate([rows for rows, _ in parts])
+            frequencies = np.concatenate([frequencies for _, frequencies in parts]).astype(np.float32)
+            idf = math.log(1 + (num_rows - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[rows] / average_length)
+            matched_rows.append(rows)
+            matched_scores.append(idf * frequencies * (self.k1 + 1) / (frequencies + norm))
+
+        if not matched_rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        # Add up the contributions of every term per row
+        rows, inverse = np.unique(np.concatenate(matched_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(matched_scores))
+        return rows.astype(np.int64), scores.astype(np.float32)
+
+    def save(self, directory):
+        """Write the index to a directory, for open() to map
+
+        Only segments not saved before are written and only new row lengths
+        appended. The manifest naming the segments is replaced last, so
+        readers see either the old or the new index; segment files it no
+        longer names are removed. Only one process may save at a time.
+        """
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for segment in self.segments:
+            if segment.file is None:
+                file = f"{segment.start:012d}-{uuid.uuid4().hex}.seg"
+                counts = segment.save(os.path.join(directory, file))
+                segment.file = file
+            else:
+                counts = {"num_terms": len(segment.terms), "num_postings": segment.size,
+                          "data_bytes": len(segment.terms.data)}
+            entries.append(dict(counts, file=segment.file, start=segment.start, num_rows=segment.num_rows))
+
+        # Lengths past the rows saved before belong to a save that never finished
+        with open(os.path.join(directory, self.LENGTHS), "ab") as f:
+            f.truncate(self.saved_rows * 4)
+            np.asarray(self.lengths[self.saved_rows:], dtype=np.int32).tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        self.saved_rows = len(self)
+
+        path = os.path.join(directory, self.MANIFEST)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "num_rows": len(self),
+                       "total_length": self.total_length, "segments": entries}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        # Processes still mapping a removed file keep reading it until they reopen
+        files = {entry["file"] for entry in entries}
+        for name in os.listdir(directory):
+            if name.endswith(".seg") and name not in files:
+                os.remove(os.path.join(directory, name))
+
+    @classmethod
+    def open(cls, directory, previous=None):
+        """Map an index written by save(), or return None if there isn't a readable one
+
+        Segments `previous` (an index opened from the same directory) has
+        mapped already are reused rather than mapped again.
+        """
+        try:
+            with open(os.path.join(directory, cls.MANIFEST), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            mapped = {segment.file: segment for segment in previous.segments} if previous else {}
+            segments = tuple(mapped.get(entry["file"]) or Segment.open(directory, **entry)
+                             for entry in manifest["segments"])
+            num_rows = manifest["num_rows"]
+            lengths = (np.memmap(os.path.join(directory, cls.LENGTHS), dtype=np.int32, mode="r",
+                                 shape=(num_rows,)) if num_rows else np.zeros(0, dtype=np.int32))
+        except (OSError, ValueError, KeyError, TypeError):
+            # Not saved yet, or a segment was removed by a newer save
+            return None
+
+        index = cls(manifest["k1"], manifest["b"])
+        index.segments = segments
+        index.lengths = lengths
+        index.total_length = manifest["total_length"]
+        index.saved_rows = num_rows
+        return index
+
+
+def top_rows(rows, scores, k):
+    """Return the k highest scoring (rows, scores), best first"""
+    if len(rows) > k:
+        top = np.argpartition(-scores, k - 1)[:k]
+        rows, scores = rows[top], scores[top]
+    order = np.argsort(-scores, kind="stable")
+    return rows[order], scores[order]
@@ -0,0 +1,266 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Thread-safe LRU cache with an optional time-to-live and hit/miss counters"""
+
+    def __init__(self, max_entries=1024, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl  # seconds, or None to keep entries until evicted
+        self.entries = OrderedDict()  # key -> (value, stored_at), oldest first
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entry if full"""
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (value, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry (counters are kept)"""
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+class EmbeddingCache:
+    """Bounded, persistent LRU cache of sentence embeddings
+
+    Entries are keyed by a hash of the model name and the whitespace-normalized
+    sentence, so boilerplate such as headers, footers and disclaimers is only
+    embedded once. Vectors live in one preallocated float32 matrix; the LRU
+    order only tracks which slot each key occupies.
+    """
+
+    def __init__(self, model_name, dim, max_entries=20000, path=None):
+        self.model_name = model_name
+        self.dim = dim
+        self.max_entries = max_entries
+        self.path = path
+
+        self.vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self.slots = OrderedDict()  # key -> slot in self.vectors, oldest first
+        self.free_slots = list(range(max_entries - 1, -1, -1))
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if path and os.path.exists(path):
+            self.load()
+
+    def key(self, text):
+        """Hash the model name together with the normalized sentence text"""
+        normalized = re.sub(r'\s+', ' ', text).strip()
+        return hashlib.sha1(f"{self.model_name}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def lookup(self, texts):
+        """Return (embeddings, missing): rows for cache hits and indices of the misses"""
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        missing = []
+        for i, text in enumerate(texts):
+            key = self.key(text)
+            slot = self.slots.get(key)
+            if slot is None:
+                missing.append(i)
+                self.misses += 1
+            else:
+                self.slots.move_to_end(key)
+                embeddings[i] = self.vectors[slot]
+                self.hits += 1
+        return embeddings, missing
+
+    def store(self, texts, embeddings):
+        """Add embeddings to the cache, evicting the least recently used entries"""
+        if self.max_entries == 0:
+            return
+        for text, embedding in zip(texts, embeddings):
+            # Zero vectors are fallbacks for failed batches, not real embeddings
+            if not embedding.any():
+                continue
+
+            key = self.key(text)
+            slot = self.slots.get(key)
+            if slot is None:
+                if not self.free_slots:
+                    _, evicted_slot = self.slots.popitem(last=False)
+                    self.free_slots.append(evicted_slot)
+                    self.evictions += 1
+                slot = self.free_slots.pop()
+            self.slots[key] = slot
+            self.slots.move_to_end(key)
+            self.vectors[slot] = embedding
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.slots),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+    def save(self):
+        """Write the cache to disk, keeping LRU order"""
+        if not self.path:
+            return
+        keys = np.array(list(self.slots.keys()), dtype="U40")
+        slots = np.array(list(self.slots.values()), dtype=np.int64)
+        # One temporary file per process, so workers saving at once never share one
+        tmp_path = f"{self.path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, keys=keys, vectors=self.vectors[slots])
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        """Read a cache written by save(); newest entries win if it is too large"""
+        try:
+            with np.load(self.path) as data:
+                keys, vectors = data["keys"], data["vectors"]
+        except Exception as e:
+            logger.warning("Could not read embedding cache: %s", e)
+            return
+        if vectors.ndim != 2 or vectors.shape[1] != self.dim:
+            return
+
+        start = max(0, len(keys) - self.max_entries)
+        for key, vector in zip(keys[start:], vectors[start:]):
+            slot = self.free_slots.pop()
+            self.slots[str(key)] = slot
+            self.vectors[slot] = vector
+
+
+class ResidencyTracker:
+    """Tracks which documents are held in memory, within a byte budget
+
+    Documents are marked used as queries touch them. After every use, the
+    least recently used documents are returned for the caller to evict until
+    the resident ones fit in the budget again; a document used again after
+    that counts as a reload. A budget of 0 means no limit.
+    """
+
+    def __init__(self, budget=0):
+        self.budget = budget  # bytes
+        self.sizes = {}  # doc_id -> bytes it takes when resident
+        self.resident = OrderedDict()  # doc_id -> bytes, least recently used first
+        self.resident_bytes = 0
+        self.evicted = set()  # documents evicted and not used since
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.loads = 0
+        self.reloads = 0
+        self.evictions = 0
+
+    def add(self, doc_id, size):
+        """Start tracking a document (not resident until used)"""
+        with self.lock:
+            self.sizes[doc_id] = size
+
+    def remove(self, doc_id):
+        """Stop tracking a document"""
+        with self.lock:
+            self.sizes.pop(doc_id, None)
+            self.evicted.discard(doc_id)
+            size = self.resident.pop(doc_id, None)
+            if size is not None:
+                self.resident_bytes -= size
+
+    def use(self, doc_ids):
+        """Mark documents as used, most recent last; returns (loaded, evicted) doc ids
+
+        loaded are the documents that weren't resident. The most recently used
+        document is never evicted, even if it alone is over budget.
+        """
+        loaded, evicted = [], []
+        with self.lock:
+            for doc_id in doc_ids:
+                size = self.sizes.get(doc_id)
+                if size is None:
+                    continue
+                if doc_id in self.resident:
+                    self.resident.move_to_end(doc_id)
+                    self.hits += 1
+                    continue
+
+                self.resident[doc_id] = size
+                self.resident_bytes += size
+                loaded.append(doc_id)
+                if doc_id in self.evicted:
+                    self.evicted.discard(doc_id)
+                    self.reloads += 1
+                else:
+                    self.loads += 1
+
+            while self.budget and self.resident_bytes > self.budget and len(self.resident) > 1:
+                doc_id, size = self.resident.popitem(last=False)
+                self.resident_bytes -= size
+                self.evicted.add(doc_id)
+                self.evictions += 1
+                evicted.append(doc_id)
+        return loaded, evicted
+
+    def stats(self):
+        """Return residency counters and current size"""
+        return {
+            "budget_bytes": self.budget,
+            "documents": len(self.sizes),
+            "resident_documents": len(self.resident),
+            "resident_bytes": self.resident_bytes,
+            "hits": self.hits,
+            "loads": self.loads,
+            "reloads": self.reloads,
+            "evictions": self.evictions
+        }
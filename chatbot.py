@@ -1,59 +1,142 @@
 import os
+import sys
+import time
+import argparse
 import uuid
 import re
+import hashlib
+import logging
+import threading
+from collections import deque
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import PyPDF2
-import torch
-from transformers import AutoTokenizer, AutoModel
-from sklearn.metrics.pairwise import cosine_similarity
+from transformers import AutoConfig, AutoTokenizer, AutoModel
+from encoders import FORK_UNSAFE_BACKENDS, SAMPLE_SENTENCES, configure_threads, load_encoder
+from document_store import DocumentStore
+from vector_index import VectorIndex, normalize_rows
+from quantization import STORAGE_DTYPES
+from ann_index import IVFIndex
+from bm25 import BM25Index, top_rows
+from chunking import TokenChunker
+from caches import EmbeddingCache, LRUCache, ResidencyTracker
+from batching import EmbeddingBatcher
+from metrics import Registry, StageTimer
+
+logger = logging.getLogger(__name__)
+
+# Ingestion stages can take minutes on long documents
+INGEST_STAGE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Text passed to the embedder is cut here before tokenizing; at a few
+# characters per token this is well past the 512 tokens the model reads
+MAX_EMBEDDED_CHARS = 4096
 
 class SimpleTokenizer:
     """Custom tokenizer that doesn't rely on NLTK"""
 
-    @staticmethod
-    def split_into_sentences(text):
-        """Split text into sentences using regex patterns"""
-        # First, clean up the text
-        text = text.replace('\n', ' ').replace('\r', ' ')
-        text = re.sub(r'\s+', ' ', text).strip()
+    # Simple sentence splitting pattern
+    SENTENCE_BOUNDARY = re.compile(r'(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|\!)\s')
+    # Periods that aren't part of a decimal number
+    PERIOD = re.compile(r'(?<!\d)\.(?!\d)')
+    WHITESPACE = re.compile(r'\s+')
 
-        # Simple sentence splitting pattern
-        pattern = r'(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|\!)\s'
-        sentences = re.split(pattern, text)
+    # Longer pieces are split further, so one sentence never fills a chunk by itself
+    MAX_SENTENCE_LENGTH = 1000
 
-        # Clean up sentences
-        result = []
-        for sentence in sentences:
-            if sentence.strip():
-                # Ensure sentence ends with punctuation
-                if not sentence.strip()[-1] in ['.', '!', '?']:
-                    sentence = sentence.strip() + '.'
-                result.append(sentence.strip())
-
-        # If we failed to split properly, try a simpler approach
-        if len(result) <= 1 and len(text) > 100:
-            # Split by periods, ensuring we don't split decimal numbers
-            result = []
-            chunks = re.split(r'(?<!\d)\.(?!\d)', text)
-            for chunk in chunks:
-                if chunk.strip():
-                    result.append(chunk.strip() + '.')
-
-        # If we still have no sentences and text is long, split into chunks
-        if len(result) <= 1 and len(text) > 200:
-            # Just split into reasonable chunks
-            words = text.split()
-            chunks = [' '.join(words[i:i+25]) for i in range(0, len(words), 25)]
-            result = [chunk + '.' for chunk in chunks if chunk.strip()]
-
-        # If document starts with a title or header, prioritize it
-        if result and len(result[0]) < 100:
-            # Move the first sentence to the front again to emphasize it
-            # This helps with "what is this document about" questions
-            result.append(result[0])
+    @classmethod
+    def _split_long(cls, piece):
+        """Break a piece without sentence boundaries into shorter segments"""
+        if len(piece) <= cls.MAX_SENTENCE_LENGTH:
+            return [piece]
 
+        # Split by periods, ensuring we don't split decimal numbers
+        parts = [part.strip() for part in cls.PERIOD.split(piece) if part.strip()]
+        result = []
+        for part in parts:
+            if len(part) <= cls.MAX_SENTENCE_LENGTH:
+                result.append(part)
+            else:
+                # Just split into reasonable chunks
+                words = part.split()
+                result.extend(' '.join(words[i:i+25]) for i in range(0, len(words), 25))
         return result
 
+    @classmethod
+    def _finish(cls, piece, page_number):
+        """Yield the final (sentence, page_number) segments of a split piece"""
+        for sentence in cls._split_long(piece):
+            # Ensure sentence ends with punctuation
+            if sentence[-1] not in ['.', '!', '?']:
+                sentence += '.'
+            yield sentence, page_number
+
+    @classmethod
+    def iter_sentences(cls, pages):
+        """Split a stream of page texts into sentences, yielding (sentence, page_number)
+
+        Works one page at a time. A sentence that runs over a page break is
+        carried into the next page and attributed to the page it starts on.
+        """
+        carry = ""
+        carry_page = 0
+
+        for page_number, page_text in enumerate(pages, 1):
+            page_text = cls.WHITESPACE.sub(' ', page_text).strip()
+            if not page_text:
+                continue
+
+            start_page = carry_page if carry else page_number
+            buffer = f"{carry} {page_text}" if carry else page_text
+            pieces = [piece.strip() for piece in cls.SENTENCE_BOUNDARY.split(buffer) if piece.strip()]
+
+            # The last piece may continue on the next page
+            carry = ""
+            if pieces and pieces[-1][-1] not in ['.', '!', '?']:
+                carry = pieces.pop()
+                carry_page = start_page if not pieces else page_number
+
+            for i, piece in enumerate(pieces):
+                yield from cls._finish(piece, start_page if i == 0 else page_number)
+
+            # Text without any sentence boundaries shouldn't pile up
+            if len(carry) > cls.MAX_SENTENCE_LENGTH:
+                yield from cls._finish(carry, carry_page)
+                carry = ""
+
+        if carry:
+            yield from cls._finish(carry, carry_page)
+
+
+def iter_page_range(file_path, start, end):
+    """Yield the cleaned text of pages [start, end) of a PDF, opening the file once
+
+    A page that fails to extract yields an empty string.
+    """
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        for page_num in range(start, end):
+            try:
+                page_text = pdf_reader.pages[page_num].extract_text() or ""
+            except Exception as e:
+                logger.warning("Error extracting text from page %d: %s", page_num, e)
+                page_text = ""
+            # Clean up text
+            yield SimpleTokenizer.WHITESPACE.sub(' ', page_text).strip()
+
+
+def extract_page_range(file_path, start, end):
+    """Extract pages [start, end) of a PDF as a list (runs in a worker process)"""
+    return list(iter_page_range(file_path, start, end))
+
+
+def extract_document(file_path):
+    """Return the text of every page of a PDF (runs in a worker process)"""
+    with open(file_path, 'rb') as file:
+        total_pages = len(PyPDF2.PdfReader(file).pages)
+    return list(iter_page_range(file_path, 0, total_pages))
+
 
 class DocumentChatbot:
     def __init__(self):
@@ -66,176 +149,1221 @@ class DocumentChatbot:
         # Set up tokenizer
         self.tokenizer_tool = SimpleTokenizer()
 
-        # Load model and tokenizer for sentence embeddings
-        print("Loading language model...")
+        # Torch threads for this worker: by default its share of the cores when
+        # gunicorn runs WEB_CONCURRENCY workers
+        configure_threads(
+            int(os.environ.get("TORCH_THREADS", 0))
+            or max(1, (os.cpu_count() or 1) // int(os.environ.get("WEB_CONCURRENCY", 1))),
+            int(os.environ.get("TORCH_INTEROP_THREADS", 1))
+        )
+
+        # Model weights are loaded now (MODEL_LOADING=eager) or on first use
+        # (lazy). Loading them before gunicorn forks its workers (--preload)
+        # lets every worker share one copy.
+        self.model_loading = os.environ.get("MODEL_LOADING", "eager")
+        self.model = None
+        self._encoder = None
+        self.model_lock = threading.Lock()
+        self.model_load_seconds = None
+
+        # Runs the model: eager, int8, torchscript or onnx (see encoders.py).
+        # Under --preload the master only loads the weights for backends that
+        # don't survive a fork; each worker sets up its encoder on first use.
+        self.encoder_backend = os.environ.get("ENCODER_BACKEND", "eager")
+        build_encoder = not (os.environ.get("PRELOAD_APP") == "1"
+                             and self.encoder_backend in FORK_UNSAFE_BACKENDS)
+
+        # Load tokenizer and model configuration for sentence embeddings.
+        # MODEL_NAME may also be a local directory (see benchmark.py).
+        logger.info("Loading language model...")
         try:
-            self.tokenizer = AutoTokenizer.from_pretrained("sentence-transformers/all-MiniLM-L6-v2")
-            self.model = AutoModel.from_pretrained("sentence-transformers/all-MiniLM-L6-v2")
-            print("Model loaded successfully!")
+            self.model_name = os.environ.get("MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            self.model_config = AutoConfig.from_pretrained(self.model_name)
+            if self.model_loading != "lazy":
+                self.load_model(build_encoder)
+            logger.info("Model loaded successfully!")
         except Exception as e:
-            print(f"Error loading model: {e}")
-            print("Using fallback model...")
+            logger.error("Error loading model: %s", e)
+            logger.warning("Using fallback model...")
             # Use a simpler, more reliable model as fallback
-            self.tokenizer = AutoTokenizer.from_pretrained("distilbert-base-uncased")
-            self.model = AutoModel.from_pretrained("distilbert-base-uncased")
-            print("Fallback model loaded successfully!")
+            self.model_name = "distilbert-base-uncased"
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            self.model_config = AutoConfig.from_pretrained(self.model_name)
+            if self.model_loading != "lazy":
+                self.load_model(build_encoder)
+            logger.info("Fallback model loaded successfully!")
+
+        # Embedding size and number of sentences encoded per forward pass
+        self.embedding_dim = self.model_config.hidden_size
+        self.embedding_batch_size = int(os.environ.get("EMBEDDING_BATCH_SIZE", 32))
+
+        # Question embeddings from concurrent requests share forward passes
+        self.query_encoder = EmbeddingBatcher(
+            self.generate_embeddings,
+            max_batch_size=int(os.environ.get("QUERY_BATCH_MAX_SIZE", 32)),
+            max_wait_ms=float(os.environ.get("QUERY_BATCH_MAX_WAIT_MS", 5))
+        )
+
+        # Repeated questions skip the encoder (question embeddings) or the whole
+        # search (answers). Answers are only valid for one version of the corpus.
+        self.question_embeddings = LRUCache(max_entries=int(os.environ.get("QUESTION_CACHE_SIZE", 1024)))
+        self.answers = LRUCache(
+            max_entries=int(os.environ.get("ANSWER_CACHE_SIZE", 1024)),
+            ttl=float(os.environ.get("ANSWER_CACHE_TTL", 300))
+        )
+        self.corpus_version = 0
+
+        # Stage timings and counters, exported at /metrics. Each process writes
+        # its own to document_data/metrics, so any worker can report them all.
+        self.metrics = Registry(os.path.join(self.data_dir, "metrics"))
+        self.ingest_stage_seconds = self.metrics.histogram(
+            "chatbot_ingest_stage_seconds",
+            "Time an ingestion job (one upload or one bulk run) spent extracting, splitting, embedding and storing",
+            labels=("stage",), buckets=INGEST_STAGE_BUCKETS)
+        self.query_stage_seconds = self.metrics.histogram(
+            "chatbot_query_stage_seconds",
+            "Time answering a question spent embedding it, scoring rows and formatting the answer",
+            labels=("stage",))
+        self.documents_ingested = self.metrics.counter(
+            "chatbot_documents_ingested_total", "Files ingested, by outcome (indexed, duplicate or failed)",
+            labels=("outcome",))
+        self.rows_embedded = self.metrics.counter(
+            "chatbot_rows_embedded_total", "Rows embedded during ingestion")
+        self.questions = self.metrics.counter(
+            "chatbot_questions_total", "Questions answered, by whether the answer was cached", labels=("cache",))
+
+        # PDFs with at least this many pages are extracted by a process pool
+        self.pdf_workers = int(os.environ.get("PDF_WORKERS", os.cpu_count() or 1))
+        self.pdf_parallel_min_pages = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", 50))
+        self.pdf_pages_per_task = int(os.environ.get("PDF_PAGES_PER_TASK", 16))
+
+        # Sentences embedded and written to disk at a time during ingestion;
+        # this, not the document size, bounds ingestion memory
+        self.ingest_batch_size = int(os.environ.get("INGEST_BATCH_SIZE", 256))
+        # Rows embedded at a time by bulk ingestion, shared between documents
+        self.bulk_batch_size = int(os.environ.get("BULK_BATCH_SIZE", 1024))
+
+        # CHUNKING=tokens packs consecutive sentences into one row of up to
+        # CHUNK_TOKENS tokens, neighbouring rows sharing CHUNK_OVERLAP sentences;
+        # CHUNKING=sentences embeds every sentence as its own row
+        self.chunker = None
+        if os.environ.get("CHUNKING", "tokens") == "tokens":
+            self.chunker = TokenChunker(self.tokenizer,
+                                        max_tokens=int(os.environ.get("CHUNK_TOKENS", 128)),
+                                        overlap=int(os.environ.get("CHUNK_OVERLAP", 1)))
 
         # Data storage
         self.documents = {}  # Store document info
-        self.document_content = {}  # Store document content
-        self.document_embeddings = {}  # Store document sentence embeddings
+        self.document_content = {}  # Memory-mapped sentences, by document
+        self.index = VectorIndex(self.embedding_dim)  # All sentence embeddings
+
+        # Reattach to documents persisted by earlier runs. Each model gets its
+        # own store since embeddings from different models can't be mixed.
+        store_dir = os.path.join(self.data_dir, self.model_name.replace("/", "--"))
+        self.store = DocumentStore(store_dir, self.embedding_dim)
+
+        # Vectors can be scored in a compact form (EMBEDDING_STORAGE=int8),
+        # re-ranking the best candidates with the float32 vectors
+        self.embedding_storage = os.environ.get("EMBEDDING_STORAGE", "float32")
+        if self.embedding_storage not in STORAGE_DTYPES:
+            logger.warning("EMBEDDING_STORAGE=%s is not supported (float32 or int8), using int8",
+                           self.embedding_storage)
+            self.embedding_storage = "int8"
+        self.index.rerank = int(os.environ.get("RERANK_CANDIDATES", 50))
+        self.attach_index()
+
+        # Optional approximate search for large corpora (ANN_MODE=ivf).
+        # Only a process holding the store lock trains and saves it; the
+        # others load the saved file (see _update_ann() and _load_ann())
+        self.ann_path = os.path.join(store_dir, "ann_ivf.npz")
+        self.ann_mtime = None  # of the saved index last loaded or written
+        if os.environ.get("ANN_MODE", "exact") == "ivf":
+            self.index.ann = IVFIndex(self.embedding_dim, nlist=int(os.environ.get("ANN_NLIST", 0)),
+                                      nprobe=int(os.environ.get("ANN_NPROBE", 8)))
+            self.index.ann_min_rows = int(os.environ.get("ANN_MIN_ROWS", 50000))
+
+        # Keyword index for exact terms (codes, names) that embeddings match poorly.
+        # RETRIEVAL_MODE: dense (embeddings only), hybrid (fuse keyword and
+        # embedding scores) or prefilter (only score sentences sharing a keyword)
+        # The committing process saves it and the others map the saved
+        # segments (see _update_lexical() and _load_lexical())
+        self.lexical = BM25Index()
+        self.lexical_dir = os.path.join(store_dir, "lexical")
+        self.lexical_mtime = None  # of the saved manifest last loaded or written
+        self.retrieval_mode = os.environ.get("RETRIEVAL_MODE", "hybrid")
+        self.hybrid_weight = float(os.environ.get("HYBRID_WEIGHT", 0.3))
+        self.lexical_candidates = int(os.environ.get("LEXICAL_CANDIDATES", 100))
+
+        # Fingerprints of uploaded files, so identical uploads are only processed once
+        self.document_hashes = {}
+
+        # Embeddings and sentences of documents are memory-mapped. Beyond
+        # MEMORY_BUDGET_MB (0 = no limit) the least recently queried
+        # documents are dropped from memory and read back when next used.
+        self.residency = ResidencyTracker(int(float(os.environ.get("MEMORY_BUDGET_MB", 0)) * 2**20))
+
+        # Serializes writes to the store, index and caches between ingestion jobs
+        self.lock = threading.RLock()
+
+        self._register_new_documents()
+        self._load_lexical()
+        if self.documents:
+            logger.info("Loaded %d stored documents", len(self.documents))
+
+        # Other processes (gunicorn workers) may add documents to the same
+        # store; they are picked up within this many seconds
+        self.refresh_interval = float(os.environ.get("CORPUS_REFRESH_INTERVAL", 1))
+        self.last_refresh = time.monotonic()
 
-    def extract_text_from_pdf(self, file_path):
-        """Extract text from a PDF file with error handling"""
-        text = ""
+        # The first process to start indexes documents the saved keyword index
+        # lacks (all of them in stores from before it was shared) and brings a
+        # missing or outdated ANN index up to date
+        if self._documents_without_keywords() or self.index.ann is not None:
+            with self.lock, self.store.locked():
+                self.refresh(force=True)
+                self._update_lexical()
+                if self.index.ann is not None:
+                    self._update_ann()
+
+        # Warm-up pass so the first question doesn't pay for lazy initialization
+        # (WARMUP=0 only loads the model); see start_warmup()
+        self.warmup_enabled = os.environ.get("WARMUP", "1") == "1"
+        self.warmup_pid = None
+        self.warmed_up = False
+        self.warmup_error = None
+        self.warmup_seconds = None
+
+        # Sentence embeddings shared across documents (headers, footers, disclaimers...)
+        self.embedding_cache = EmbeddingCache(
+            self.model_name, self.embedding_dim,
+            max_entries=int(os.environ.get("EMBEDDING_CACHE_SIZE", 20000)),
+            path=os.path.join(store_dir, "embedding_cache.npz")
+        )
+
+    def load_model(self, build_encoder=True):
+        """Load the model weights and, unless build_encoder is False, set up the encoder, if not done yet"""
+        with self.model_lock:
+            if self._encoder is not None:
+                return
+            start = time.perf_counter()
+            if self.model is None:
+                self.model = AutoModel.from_pretrained(self.model_name)
+            if build_encoder:
+                encoder = load_encoder(
+                    self.encoder_backend, self.model, self.tokenizer,
+                    onnx_path=os.path.join(self.data_dir, "onnx", self.model_name.replace("/", "--") + ".onnx")
+                )
+            self.model_load_seconds = (self.model_load_seconds or 0.0) + time.perf_counter() - start
+            if not build_encoder:
+                logger.info("Loaded %s weights in %.1fs; the %s encoder is set up on first use",
+                            self.model_name, self.model_load_seconds, self.encoder_backend)
+                return
+            self._encoder = encoder
+        logger.info("Loaded %s (%s encoder) in %.1fs", self.model_name, encoder.backend, self.model_load_seconds)
+
+    @property
+    def encoder(self):
+        """The embedding model, loaded on first use when MODEL_LOADING=lazy"""
+        if self._encoder is None:
+            self.load_model()
+        return self._encoder
+
+    def start_warmup(self):
+        """Warm up in a background thread, once per process
+
+        Under gunicorn --preload this must run in each worker after the fork,
+        not in the master: torch's thread pools don't survive a fork. With
+        warm-up disabled the thread only loads the model.
+        """
+        if self.warmup_pid == os.getpid():
+            return
+        self.warmup_pid = os.getpid()
+        self.warmed_up = False
+        threading.Thread(target=self.warmup, name="warmup", daemon=True).start()
+
+    def warmup(self):
+        """Run the model and a search once, so the first real question isn't slow"""
+        start = time.perf_counter()
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-
-                # First pass: try to get text from the first few pages
-                # These often contain the most important information
-                for page_num in range(min(3, len(pdf_reader.pages))):
-                    try:
-                        page_text = pdf_reader.pages[page_num].extract_text()
-                        if page_text:
-                            text += page_text + " "
-                    except Exception as e:
-                        print(f"Warning: Error extracting text from page {page_num}: {e}")
-
-                # Second pass: get the rest of the document
-                if len(pdf_reader.pages) > 3:
-                    for page_num in range(3, len(pdf_reader.pages)):
-                        try:
-                            page_text = pdf_reader.pages[page_num].extract_text()
-                            if page_text:
-                                text += page_text + " "
-                        except Exception as e:
-                            print(f"Warning: Error extracting text from page {page_num}: {e}")
+            if not self.warmup_enabled:
+                self.load_model()
+                return
+            # A few batch shapes, then the path a question takes
+            self.generate_embeddings(["Warm up."] * self.embedding_batch_size)
+            self.generate_embeddings([" ".join(["warm up"] * 100)] * 2)
+            question = "What is this document about?"
+            self.search(question, self.generate_embeddings([question])[0])
+            self.warmup_seconds = time.perf_counter() - start
+            self.warmed_up = True
+            logger.info("Warmed up in %.1fs", self.warmup_seconds)
         except Exception as e:
-            print(f"Error reading PDF: {e}")
+            self.warmup_error = str(e)
+            logger.error("Error warming up: %s", e)
+
+    def readiness(self):
+        """Report whether the model and index are ready to answer questions"""
+        return {
+            "ready": self.warmed_up if self.warmup_enabled else self._encoder is not None,
+            "model_loaded": self._encoder is not None,
+            "warmed_up": self.warmed_up,
+            "warmup_error": self.warmup_error,
+            "model_load_seconds": self.model_load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "documents": len(self.documents),
+            "index_rows": len(self.index),
+            "pid": os.getpid(),
+            "memory": self.process_memory()
+        }
+
+    @staticmethod
+    def process_memory():
+        """Return this process's memory use in MB (Linux only)
+
+        pss counts pages shared with other processes (such as model weights
+        shared by preloaded gunicorn workers) divided among them.
+        """
+        memory = {}
+        try:
+            with open("/proc/self/smaps_rollup", "r") as f:
+                for line in f:
+                    name, _, value = line.partition(":")
+                    if name in ("Rss", "Pss", "Private_Dirty"):
+                        memory[name.lower() + "_mb"] = round(int(value.split()[0]) / 1024, 1)
+        except (OSError, ValueError):
+            pass
+        return memory
 
-        # Clean up text
-        text = re.sub(r'\s+', ' ', text).strip()
+    def attach_index(self):
+        """Point the index at the stored vectors, and their quantized copy if enabled"""
+        codes, scales = None, None
+        if self.embedding_storage != "float32":
+            codes, scales = self.store.quantized(self.embedding_storage)
+        self.index.attach(self.store.embeddings(), codes, scales)
 
-        if not text.strip():
-            print("Warning: No text was extracted from the PDF")
+    @staticmethod
+    def file_fingerprint(file_path):
+        """Return the SHA-256 hex digest of a file's contents"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
 
-        return text
+    def iter_pages(self, file_path, progress=None):
+        """Yield the cleaned text of every page of a PDF, in page order
 
-    def generate_embedding(self, text):
-        """Generate embedding for a piece of text with error handling"""
+        Long documents are extracted by a process pool, since PyPDF2 is
+        CPU-bound pure Python. Pages are handed out in ranges of
+        pdf_pages_per_task with only a couple of ranges per worker in flight,
+        so memory stays bounded however long the document is.
+        """
         try:
-            # Truncate long text to prevent issues
-            if len(text) > 1000:
-                text = text[:1000]
-
-            inputs = self.tokenizer(text, padding=True, truncation=True,
-                                  return_tensors="pt", max_length=512)
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-
-            # Use mean of the last hidden state as the embedding
-            embeddings = outputs.last_hidden_state.mean(dim=1)
-            return embeddings.cpu().numpy()
+            with open(file_path, 'rb') as file:
+                total_pages = len(PyPDF2.PdfReader(file).pages)
         except Exception as e:
-            print(f"Error generating embedding: {e}")
-            # Return zero embedding as fallback
-            return np.zeros((1, 384))  # Default dimension for MiniLM model
+            logger.error("Error reading PDF: %s", e)
+            return
+
+        workers = min(self.pdf_workers, total_pages)
+        if workers < 2 or total_pages < self.pdf_parallel_min_pages:
+            for page_num, page_text in enumerate(iter_page_range(file_path, 0, total_pages), 1):
+                if progress:
+                    progress("extracting", pages_extracted=page_num, total_pages=total_pages)
+                yield page_text
+            return
+
+        ranges = iter([(start, min(start + self.pdf_pages_per_task, total_pages))
+                       for start in range(0, total_pages, self.pdf_pages_per_task)])
+        pages_extracted = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            in_flight = deque(
+                (start, end, executor.submit(extract_page_range, file_path, start, end))
+                for start, end in islice(ranges, 2 * workers)
+            )
+            while in_flight:
+                start, end, future = in_flight.popleft()
+                try:
+                    pages = future.result()
+                except Exception as e:
+                    # The worker died; extract its pages here instead
+                    logger.warning("Worker failed on pages %d-%d: %s", start, end - 1, e)
+                    pages = extract_page_range(file_path, start, end)
+
+                # Keep the pool busy while this range is consumed
+                for next_start, next_end in islice(ranges, 1):
+                    in_flight.append((next_start, next_end,
+                                      executor.submit(extract_page_range, file_path, next_start, next_end)))
+
+                pages_extracted += len(pages)
+                if progress:
+                    progress("extracting", pages_extracted=pages_extracted, total_pages=total_pages)
+                yield from pages
+
+    def generate_embeddings(self, sentences, batch_size=None, progress=None):
+        """Generate embeddings for many sentences with length-bucketed batches
+
+        If given, progress is called with the number of sentences embedded so far.
+        """
+        if batch_size is None:
+            batch_size = self.embedding_batch_size
+
+        embeddings = np.zeros((len(sentences), self.embedding_dim), dtype=np.float32)
+        if not sentences:
+            return embeddings
+
+        # Truncate long text to prevent issues
+        texts = [text[:MAX_EMBEDDED_CHARS] for text in sentences]
+
+        # Tokenize once without padding so we know each sentence's length
+        encoded = self.tokenizer(texts, truncation=True, max_length=512)
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+
+        # Group sentences of similar length together to keep padding small
+        order = sorted(range(len(texts)), key=lambda i: lengths[i])
+
+        for batch_num, start in enumerate(range(0, len(order), batch_size)):
+            batch_indices = order[start:start + batch_size]
+            try:
+                features = [{key: encoded[key][i] for key in encoded.keys()} for i in batch_indices]
+                inputs = self.tokenizer.pad(features, padding=True, return_tensors="pt")
+                embeddings[batch_indices] = self.encoder(inputs["input_ids"], inputs["attention_mask"])
+            except Exception as e:
+                # Leave zero embeddings for this batch as fallback
+                logger.error("Error generating embeddings for batch %d: %s", batch_num, e)
+
+            # Show progress for large documents
+            done = min(start + batch_size, len(texts))
+            if progress:
+                progress(done)
+            if len(texts) > 100 and batch_num % 5 == 0:
+                logger.debug("Progress: %d/%d segments processed", done, len(texts))
+
+        return embeddings
+
+    def embed_sentences(self, sentences, progress=None):
+        """Generate embeddings for sentences, reusing cached ones where possible
+
+        If given, progress is called with the number of sentences embedded so far.
+        """
+        with self.lock:
+            embeddings, missing = self.embedding_cache.lookup(sentences)
+        cached = len(sentences) - len(missing)
+        if progress:
+            progress(cached)
+
+        # Embed each distinct missing sentence once, even if it repeats
+        unique_texts = list(dict.fromkeys(sentences[i] for i in missing))
+        if unique_texts:
+            def report(done):
+                if progress:
+                    # Repeated sentences are embedded once but count once per occurrence
+                    progress(cached + done * len(missing) // len(unique_texts))
+
+            new_embeddings = self.generate_embeddings(unique_texts, progress=report)
+            with self.lock:
+                self.embedding_cache.store(unique_texts, new_embeddings)
+            positions = {text: row for row, text in enumerate(unique_texts)}
+            for i in missing:
+                embeddings[i] = new_embeddings[positions[sentences[i]]]
+
+        if progress:
+            progress(len(sentences))
+        return embeddings
+
+    @staticmethod
+    def _ensure_segmented(segments):
+        """Pass segments through, force-splitting a document that yields only one"""
+        head = list(islice(segments, 2))
+        if len(head) == 1 and len(head[0][0]) > 50:
+            logger.warning("Document appears to have very little text or couldn't be properly segmented")
+            # Force segment by splitting into chunks
+            text, page_number = head[0]
+            chunks = [text[i:i+100] for i in range(0, len(text), 100)]
+            head = [(chunk + ".", page_number) for chunk in chunks if chunk.strip()]
+            logger.info("Forced segmentation into %d chunks", len(head))
+        return chain(head, segments)
+
+    def _build_lexical_index(self, doc_id):
+        """Build a stored document's keyword index from its rows"""
+        sentences = self.store.load_sentences(doc_id)
+        lexical = BM25Index()
+        lexical.add(sentences.text(first, end) for first, end in self.store.document_spans(doc_id))
+        return lexical
+
+    def _documents_without_keywords(self):
+        """Return the stored documents whose rows the keyword index doesn't cover, in row order"""
+        return sorted((info for info in self.store.documents.values()
+                       if info["row_start"] + info["num_rows"] > len(self.lexical)),
+                      key=lambda info: info["row_start"])
 
-    def process_document(self, file_path, filename=None):
-        """Process a document and generate embeddings"""
+    def _load_lexical(self):
+        """Map the saved keyword index if it changed since this process last read it"""
+        try:
+            mtime = os.stat(os.path.join(self.lexical_dir, BM25Index.MANIFEST)).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self.lexical_mtime:
+            lexical = BM25Index.open(self.lexical_dir, previous=self.lexical)
+            if lexical is not None:
+                self.lexical = lexical
+                self.lexical_mtime = mtime
+
+    def _update_lexical(self, new_indexes=None):
+        """Add the documents the keyword index lacks to it and save it; the caller holds both locks
+
+        new_indexes maps the ids of documents just written to the keyword
+        index built while writing them; other documents are indexed from
+        their stored rows.
+        """
+        self._load_lexical()
+        missing = self._documents_without_keywords()
+        if not missing:
+            return
+        new_indexes = new_indexes or {}
+        for info in missing:
+            lexical = new_indexes.get(info["id"])
+            if lexical is None:
+                lexical = self._build_lexical_index(info["id"])
+            self.lexical.extend(lexical, info["row_start"])
+        self.lexical.save(self.lexical_dir)
+        self.lexical_mtime = os.stat(os.path.join(self.lexical_dir, BM25Index.MANIFEST)).st_mtime_ns
+
+        # Stores from before the index was shared kept one file per document
+        for name in os.listdir(self.lexical_dir):
+            if name.endswith(".pkl"):
+                os.remove(os.path.join(self.lexical_dir, name))
+
+    def _register_new_documents(self):
+        """Add stored documents this process doesn't know yet; returns how many there were"""
+        new_documents = sorted(
+            (info for doc_id, info in self.store.documents.items() if doc_id not in self.documents),
+            key=lambda info: info["row_start"]
+        )
+        for info in new_documents:
+            doc_id = info["id"]
+            # Register the rows before exposing them, so a concurrent search
+            # never sees vectors it can't map back to a document
+            self.index.add_document(doc_id, info["row_start"], info["num_rows"])
+            self.documents[doc_id] = {
+                "id": doc_id,
+                "filename": info["filename"],
+                "path": info["path"]
+            }
+            if info.get("sha256"):
+                self.document_hashes[info["sha256"]] = doc_id
+            self.residency.add(doc_id, self._resident_size(info))
+
+        if new_documents:
+            self.attach_index()
+        return len(new_documents)
+
+    def _load_ann(self):
+        """Load the saved ANN index if it changed since this process last read it
+
+        Returns False if there is no readable saved index.
+        """
+        try:
+            mtime = os.stat(self.ann_path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime != self.ann_mtime:
+            ann = IVFIndex.load(self.ann_path, nprobe=self.index.ann.nprobe)
+            if ann is None:
+                return False
+            self.index.ann = ann
+            self.ann_mtime = mtime
+        return True
+
+    def _update_ann(self):
+        """Train the ANN index or add new rows to it, and save it; the caller holds both locks
+
+        Training can take a while on a large corpus, so it happens once, in
+        the process committing documents, rather than in every worker.
+        """
+        saved = self._load_ann()
+        if self.index.update_ann() or (not saved and self.index.ann.trained):
+            self.index.ann.save(self.ann_path)
+            self.ann_mtime = os.stat(self.ann_path).st_mtime_ns
+
+    def _unregister_removed_documents(self):
+        """Forget documents that are no longer in the store; returns how many there were"""
+        removed = [doc_id for doc_id in self.documents if doc_id not in self.store.documents]
+        for doc_id in removed:
+            self.index.remove_document(doc_id)
+            del self.documents[doc_id]
+            self.document_content.pop(doc_id, None)
+            self.residency.remove(doc_id)
+            for fingerprint in [key for key, value in self.document_hashes.items() if value == doc_id]:
+                del self.document_hashes[fingerprint]
+        return len(removed)
+
+    def delete_document(self, doc_id):
+        """Remove a document from the store and the indexes; returns False if there is no such document
+
+        Its rows stay in the store's files but are never searched again.
+        """
+        with self.lock, self.store.locked():
+            self.refresh(force=True)
+            if doc_id not in self.documents:
+                return False
+            # Bulk ingestion of the folder it came from won't index it again
+            self._remove_document(doc_id, deleted=True)
+            self.corpus_changed()
+        logger.info("Deleted document %s", doc_id)
+        return True
+
+    def _remove_document(self, doc_id, deleted=False):
+        """Remove a stored document and forget it; the caller holds both locks and has refreshed"""
+        self.store.remove_document(doc_id, deleted=deleted)
+        self._unregister_removed_documents()
+
+    def _resident_size(self, info):
+        """Estimate the bytes a document takes in memory: its vectors, row metadata and sentences"""
+        row_bytes = self.embedding_dim * 4 + 12  # float32 vector, page and span
+        if self.embedding_storage != "float32":
+            row_bytes += self.embedding_dim * np.dtype(STORAGE_DTYPES[self.embedding_storage]).itemsize + 4
+        return info["num_rows"] * row_bytes + self.store.sentences_size(info["id"])
+
+    def _use_documents(self, doc_ids, prefetch=False):
+        """Mark documents as used by a query, evicting the least recently used ones over the memory budget
+
+        With prefetch, the rows of documents that weren't resident are read ahead.
+        """
+        loaded, evicted = self.residency.use(doc_ids)
+        for doc_id in evicted:
+            doc_range = self.index.doc_ranges.get(doc_id)
+            if doc_range:
+                self.store.release_rows(*doc_range)
+            self.document_content.pop(doc_id, None)
+            self.store.release_sentences(doc_id)
+        if prefetch:
+            for doc_id in loaded:
+                doc_range = self.index.doc_ranges.get(doc_id)
+                if doc_range:
+                    self.store.prefetch_rows(*doc_range)
+
+    def refresh(self, force=False):
+        """Pick up documents that other processes sharing the store have added or removed
+
+        Between forced calls this checks at most every refresh_interval
+        seconds, and a check is a stat() of the catalog unless it changed.
+        The new rows are mapped, not copied, so workers share their memory.
+        """
+        if not force and time.monotonic() - self.last_refresh < self.refresh_interval:
+            return
+        with self.lock:
+            self.last_refresh = time.monotonic()
+            if self.store.reload():
+                added = self._register_new_documents()
+                if added:
+                    logger.info("Picked up %d documents added by another process", added)
+                removed = self._unregister_removed_documents()
+                if removed:
+                    logger.info("Dropped %d documents removed by another process", removed)
+                self.corpus_changed()
+            # The committing process saves the keyword and ANN indexes after the catalog
+            self._load_lexical()
+            if self.index.ann is not None:
+                self._load_ann()
+
+    def process_document(self, file_path, filename=None, progress=None):
+        """Process a document and generate embeddings
+
+        Pages stream out of the extractor into the sentence splitter and the
+        chunker, and rows are embedded and written to disk in fixed-size
+        batches, so memory use depends on the batch size rather than the
+        document size.
+        If given, progress(stage, **counts) is called as processing advances.
+        """
         if filename is None:
             filename = os.path.basename(file_path)
+        if progress is None:
+            progress = lambda stage, **counts: None
+
+        # An identical file has already been processed: reuse it
+        progress("hashing")
+        timer = StageTimer()
+        with timer.stage("extract"):
+            file_stat = os.stat(file_path)
+            fingerprint = self.file_fingerprint(file_path)
+        if fingerprint in self.document_hashes:
+            logger.info("Document %s was already processed", filename)
+            self.documents_ingested.inc(outcome="duplicate")
+            return self.document_hashes[fingerprint]
 
         # Generate a unique ID for the document
         document_id = str(uuid.uuid4())
 
-        print(f"Processing document: {filename}")
+        logger.info("Processing document: %s", filename)
+        descriptors = self._descriptors(filename)
 
-        # Extract text from PDF
-        text = self.extract_text_from_pdf(file_path)
-        print(f"Extracted {len(text)} characters of text")
+        # Extract pages and split them into sentences as they arrive
+        pages = timer.iterate("extract", self.iter_pages(file_path, progress=progress))
+        segments = self._ensure_segmented(timer.iterate("split", self.tokenizer_tool.iter_sentences(pages)))
+        rows = timer.iterate("split", self._iter_rows(descriptors, segments))
+
+        writer = self.store.begin_document(document_id)
+        lexical = BM25Index()
+        try:
+            content_sentences = 0
+            for batch in self._batches(rows, self.ingest_batch_size):
+                texts = [" ".join(sentences) for sentences, _, _ in batch]
+                with timer.stage("embed"):
+                    embeddings = self.embed_sentences(texts)
+                with timer.stage("store"):
+                    self._write_rows(writer, lexical, batch, texts, embeddings)
+                self.rows_embedded.inc(len(batch))
 
-        if not text.strip():
-            print("Error: No text could be extracted from this document")
-            return None
+                content_sentences = writer.sentences - len(descriptors)
+                progress("embedding", sentences_embedded=writer.sentences)
 
-        # Split text into sentences using our custom tokenizer
-        sentences = self.tokenizer_tool.split_into_sentences(text)
-        print(f"Split into {len(sentences)} sentences/segments")
+            if content_sentences <= 0:
+                logger.error("No text could be extracted from %s", filename)
+                writer.abort()
+                self.documents_ingested.inc(outcome="failed")
+                return None
+            logger.info("Split %s into %d sentences/segments and embedded them as %d rows",
+                        filename, content_sentences, writer.rows)
 
-        if len(sentences) < 2:
-            print("Warning: Document appears to have very little text or couldn't be properly segmented")
-            if len(text) > 50:
-                # Force segment by splitting into chunks
-                chunks = [text[i:i+100] for i in range(0, len(text), 100)]
-                sentences = [chunk + "." for chunk in chunks if chunk.strip()]
-                print(f"Forced segmentation into {len(sentences)} chunks")
+            progress("saving")
+            with timer.stage("store"):
+                with self.lock:
+                    self.embedding_cache.save()
+                    stats = self.embedding_cache.stats()
+                committed_id = self._commit_document(writer, lexical, {
+                    "id": document_id,
+                    "filename": filename,
+                    "path": file_path,
+                    "sha256": fingerprint,
+                    "size": file_stat.st_size,
+                    "mtime_ns": file_stat.st_mtime_ns
+                })
+            logger.debug("Embedding cache: %d hits, %d misses", stats["hits"], stats["misses"])
+        except BaseException:
+            writer.abort()
+            self.documents_ingested.inc(outcome="failed")
+            raise
 
-        # Add the title/filename as a sentence - this helps with "about" questions
+        timer.observe(self.ingest_stage_seconds)
+        if committed_id == document_id:
+            logger.info("Document processed successfully! ID: %s", document_id)
+            self.documents_ingested.inc(outcome="indexed")
+        else:
+            self.documents_ingested.inc(outcome="duplicate")
+        return committed_id
+
+    @staticmethod
+    def _descriptors(filename):
+        """Return the (sentence, page_number) segments that open every document"""
+        # Add the title/filename and an explicit document descriptor as the
+        # first sentences - this helps with "about" questions
         clean_filename = os.path.splitext(filename)[0].replace("_", " ").replace("-", " ")
-        if clean_filename not in sentences:
-            sentences.insert(0, clean_filename + ".")
-            print("Added filename as a document descriptor")
-
-        # Add an explicit document descriptor sentence
-        document_descriptor = f"This document is about {clean_filename}."
-        sentences.insert(1, document_descriptor)
-
-        # Generate embeddings for each sentence
-        print("Generating embeddings...")
-        embeddings = []
-        for i, sentence in enumerate(sentences):
-            if sentence.strip():  # Skip empty sentences
+        return [(clean_filename + ".", 0), (f"This document is about {clean_filename}.", 0)]
+
+    @staticmethod
+    def _write_rows(writer, lexical, rows, texts, embeddings):
+        """Append (sentences, first_index, page_number) rows and their embeddings to a document"""
+        # Overlapping rows repeat sentences the writer already has
+        new_sentences = []
+        for sentences, first, _ in rows:
+            new_sentences.extend(sentences[writer.sentences + len(new_sentences) - first:])
+        writer.append(new_sentences, embeddings,
+                      [page_number for _, _, page_number in rows],
+                      [(first, first + len(sentences)) for sentences, first, _ in rows])
+        lexical.add(texts)
+
+    def _commit_document(self, writer, lexical, info, replaces=None):
+        """Store a written document and make it searchable; returns its id
+
+        If an identical file was committed in the meantime, the writer is
+        discarded and that document's id returned instead. A document id in
+        `replaces` (an earlier version of the same file) is removed in the
+        same step.
+        """
+        # The lock keeps concurrent ingestion jobs from interleaving their
+        # writes to the store and the index
+        with self.lock, self.store.locked():
+            # Catch up with commits from other processes first, so the
+            # duplicate check and the row offsets are current
+            self.refresh(force=True)
+
+            # The same file may have finished in another job in the meantime
+            doc_id = self.document_hashes.get(info["sha256"])
+            if doc_id is None:
+                self.store.commit_document(writer, info)
+                self._register_new_documents()
+                self._update_lexical({info["id"]: lexical})
+                if self.index.ann is not None:
+                    self._update_ann()
+                doc_id = info["id"]
+            else:
+                writer.abort()
+            if replaces in self.store.documents and replaces != doc_id:
+                self._remove_document(replaces)
+            self.corpus_changed()
+        return doc_id
+
+    def ingest_files(self, file_paths, filenames=None, progress=None, skip_deleted=True):
+        """Index many PDFs at once; returns the doc_id of every file (None if not indexed)
+
+        Files already indexed under the same path, size and modification
+        time are skipped without being read, and files identical to an
+        indexed one are skipped after hashing them, without extracting
+        their text, so an interrupted run resumes where it stopped. A
+        changed file replaces the document indexed from its path. Files
+        whose document was deleted are skipped unless skip_deleted is False
+        (as for an explicit upload), so a deleted document stays deleted.
+
+        Text is extracted by a process pool a whole file at a time while
+        earlier files are embedded, and rows from consecutive files share
+        embedding batches. If given, progress(stage, **counts) is called
+        as files are done.
+        """
+        if filenames is None:
+            filenames = [os.path.basename(path) for path in file_paths]
+        if progress is None:
+            progress = lambda stage, **counts: None
+        self.refresh(force=True)
+
+        doc_ids = [None] * len(file_paths)
+        counts = {"files_total": len(file_paths), "files_indexed": 0, "files_unchanged": 0,
+                  "files_deleted": 0, "files_failed": 0, "rows_embedded": 0}
+
+        timer = StageTimer()
+        indexed = {os.path.abspath(info["path"]): info for info in self.store.documents.values()}
+        todo = []  # (index, stat, fingerprint, id of the document indexed from the same path)
+        seen = {}  # fingerprint -> index of the first file with it
+        copies = []  # (index, index of an identical file earlier in this run)
+        restamped = {}  # doc_id -> size and mtime of its unchanged file
+        replaced = []  # documents of files whose content is now indexed as another document
+        for i, path in enumerate(file_paths):
+            info = indexed.get(os.path.abspath(path))
+            try:
+                file_stat = os.stat(path)
+                if info and (info.get("size"), info.get("mtime_ns")) == (file_stat.st_size, file_stat.st_mtime_ns):
+                    doc_ids[i] = info["id"]
+                    counts["files_unchanged"] += 1
+                    continue
+                with timer.stage("extract"):
+                    fingerprint = self.file_fingerprint(path)
+            except OSError as e:
+                logger.error("Error reading %s: %s", path, e)
+                counts["files_failed"] += 1
+                continue
+
+            # Known content needs no extraction
+            if skip_deleted and fingerprint in self.store.deleted:
+                counts["files_deleted"] += 1
+            elif fingerprint in self.document_hashes:
+                doc_ids[i] = self.document_hashes[fingerprint]
+                counts["files_unchanged"] += 1
+                if info and info["id"] == doc_ids[i]:
+                    # Touched but unchanged: remember the new stamp so the next run skips it unread
+                    restamped[info["id"]] = {"size": file_stat.st_size, "mtime_ns": file_stat.st_mtime_ns}
+                elif info:
+                    replaced.append(info["id"])
+            elif fingerprint in seen:
+                copies.append((i, seen[fingerprint]))
+                counts["files_unchanged"] += 1
+            else:
+                seen[fingerprint] = i
+                todo.append((i, file_stat, fingerprint, info["id"] if info else None))
+
+        if restamped or replaced:
+            with self.lock, self.store.locked():
+                self.refresh(force=True)
+                for doc_id, stamp in restamped.items():
+                    if doc_id in self.store.documents:
+                        self.store.update_document(doc_id, **stamp)
+                for doc_id in replaced:
+                    if doc_id in self.store.documents:
+                        self._remove_document(doc_id)
+                self.corpus_changed()
+        progress("indexing", **counts)
+
+        def documents():
+            """Open a writer for every extracted file, yielding (document, rows)"""
+            extracted = timer.iterate("extract", self._extract_files([file_paths[i] for i, _, _, _ in todo]))
+            for (i, file_stat, fingerprint, replaces), pages in zip(todo, extracted):
+                if isinstance(pages, Exception):
+                    logger.error("Error extracting %s: %s", file_paths[i], pages)
+                    counts["files_failed"] += 1
+                    continue
+
+                descriptors = self._descriptors(filenames[i])
+                document = {
+                    "index": i,
+                    "info": {
+                        "id": str(uuid.uuid4()),
+                        "filename": filenames[i],
+                        "path": file_paths[i],
+                        "sha256": fingerprint,
+                        "size": file_stat.st_size,
+                        "mtime_ns": file_stat.st_mtime_ns
+                    },
+                    "replaces": replaces,
+                    "descriptors": len(descriptors),
+                    "writer": None,
+                    "lexical": BM25Index(),
+                    "done": False
+                }
+                segments = self._ensure_segmented(timer.iterate("split", self.tokenizer_tool.iter_sentences(pages)))
+                yield document, timer.iterate("split", self._iter_rows(descriptors, segments))
+
+        def rows():
+            """Yield (document, row) across all files, marking each document done after its last row"""
+            for document, document_rows in documents():
+                document["writer"] = self.store.begin_document(document["info"]["id"])
+                open_documents.append(document)
+                for row in document_rows:
+                    yield document, row
+                document["done"] = True
+
+        def commit(document):
+            i, writer = document["index"], document["writer"]
+            if writer.sentences <= document["descriptors"]:
+                logger.error("No text could be extracted from %s", file_paths[i])
+                writer.abort()
+                counts["files_failed"] += 1
+                return
+            try:
+                doc_ids[i] = self._commit_document(writer, document["lexical"], document["info"],
+                                                   replaces=document["replaces"])
+                counts["files_indexed"] += 1
+            except Exception as e:
+                logger.error("Error saving %s: %s", file_paths[i], e)
+                writer.abort()
+                counts["files_failed"] += 1
+
+        open_documents = []
+        try:
+            for batch in self._batches(rows(), self.bulk_batch_size):
+                texts = [" ".join(sentences) for _, (sentences, _, _) in batch]
+                with timer.stage("embed"):
+                    embeddings = self.embed_sentences(texts)
+
+                with timer.stage("store"):
+                    # Hand each document its share of the batch, in order
+                    start = 0
+                    while start < len(batch):
+                        document = batch[start][0]
+                        end = start
+                        while end < len(batch) and batch[end][0] is document:
+                            end += 1
+                        self._write_rows(document["writer"], document["lexical"], [row for _, row in batch[start:end]],
+                                         texts[start:end], embeddings[start:end])
+                        start = end
+                    counts["rows_embedded"] += len(batch)
+                    self.rows_embedded.inc(len(batch))
+
+                    for document in [document for document in open_documents if document["done"]]:
+                        open_documents.remove(document)
+                        commit(document)
+                progress("indexing", **counts)
+
+            # Documents whose last row ended the final batch, or that had none
+            with timer.stage("store"):
+                for document in open_documents:
+                    commit(document)
+            open_documents = []
+        finally:
+            # Interrupted: throw away what isn't committed; a rerun redoes it
+            for document in open_documents:
+                document["writer"].abort()
+
+        for i, original in copies:
+            doc_ids[i] = doc_ids[original]
+
+        with self.lock:
+            self.embedding_cache.save()
+        timer.observe(self.ingest_stage_seconds)
+        self.documents_ingested.inc(counts["files_indexed"], outcome="indexed")
+        self.documents_ingested.inc(counts["files_unchanged"], outcome="duplicate")
+        self.documents_ingested.inc(counts["files_failed"], outcome="failed")
+        progress("indexing", **counts)
+        return doc_ids
+
+    def _extract_files(self, file_paths):
+        """Yield the pages of each file in order, or the exception raised extracting it
+
+        Whole files are handed to a process pool, with a couple of files per
+        worker in flight, so extraction runs ahead of embedding.
+        """
+        if not file_paths:
+            return
+        workers = max(1, min(self.pdf_workers, len(file_paths)))
+        paths = iter(file_paths)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            in_flight = deque(executor.submit(extract_document, path) for path in islice(paths, 2 * workers))
+            while in_flight:
+                future = in_flight.popleft()
+                for path in islice(paths, 1):
+                    in_flight.append(executor.submit(extract_document, path))
                 try:
-                    embedding = self.generate_embedding(sentence)
-                    embeddings.append(embedding[0])  # Remove batch dimension
+                    yield future.result()
                 except Exception as e:
-                    print(f"Error embedding segment {i}: {e}")
-                    # Add zero embedding as placeholder
-                    embeddings.append(np.zeros(384))  # Default dimension
+                    yield e
 
-            # Show progress for large documents
-            if len(sentences) > 100 and i % 50 == 0:
-                print(f"Progress: {i}/{len(sentences)} segments processed")
-
-        if not embeddings:
-            print("Error: Could not generate any embeddings")
-            return None
-
-        # Store data
-        self.documents[document_id] = {
-            "id": document_id,
-            "filename": filename,
-            "path": file_path
-        }
+    def _iter_rows(self, descriptors, segments):
+        """Yield (sentences, first_index, page_number) for every row of a document
+
+        The descriptors get a row each, so they stay easy to find; the
+        content is packed into chunks unless chunking is turned off.
+        """
+        for i, (sentence, page_number) in enumerate(descriptors):
+            yield [sentence], i, page_number
+        if self.chunker is None:
+            for i, (sentence, page_number) in enumerate(segments, len(descriptors)):
+                yield [sentence], i, page_number
+        else:
+            for sentences, first, page_number in self.chunker.iter_chunks(segments):
+                yield sentences, first + len(descriptors), page_number
+
+    @staticmethod
+    def _batches(items, size):
+        """Group an iterable into lists of at most size items"""
+        items = iter(items)
+        while True:
+            batch = list(islice(items, size))
+            if not batch:
+                return
+            yield batch
+
+    def get_sentences(self, doc_id):
+        """Return a document's sentences as a SentenceBuffer, mapping it on first use"""
+        if doc_id not in self.document_content:
+            self.document_content[doc_id] = {
+                "sentences": self.store.load_sentences(doc_id)
+            }
+        return self.document_content[doc_id]["sentences"]
+
+    def get_span(self, doc_id, idx):
+        """Return the [first, end) range of sentences in row idx of a document"""
+        first, end = (int(i) for i in self.store.spans()[self.index.doc_ranges[doc_id][0] + idx])
+        if end == 0:
+            # Rows stored before chunking hold the sentence with their own index
+            return idx, idx + 1
+        return first, end
+
+    def get_text(self, doc_id, idx):
+        """Return the text of row idx of a document"""
+        return self.get_sentences(doc_id).text(*self.get_span(doc_id, idx))
+
+    def get_context(self, doc_id, idx, sentence=None):
+        """Return a sentence of a row with two sentences either side of it
+
+        The sentence defaults to the first one of the row.
+        """
+        doc_sentences = self.get_sentences(doc_id)
+        if sentence is None:
+            sentence = self.get_span(doc_id, idx)[0]
+        return doc_sentences.text(max(0, sentence - 2), min(len(doc_sentences), sentence + 3))
+
+    def best_sentences(self, matches, question_embedding):
+        """Return, for each (doc_id, row_idx, similarity) match, the sentence of its row closest to the question
+
+        A chunk spans several sentences; answers quote the one that matches best rather than the whole chunk.
+        """
+        spans = [self.get_span(doc_id, idx) for doc_id, idx, _ in matches]
+        texts = []
+        for (doc_id, _, _), (first, end) in zip(matches, spans):
+            if end - first > 1:
+                doc_sentences = self.get_sentences(doc_id)
+                texts.extend(doc_sentences[i] for i in range(first, end))
+        if not texts:
+            return [first for first, _ in spans]
+
+        scores = normalize_rows(self.embed_sentences(texts)) @ normalize_rows(question_embedding[None, :])[0]
+        best = []
+        offset = 0
+        for first, end in spans:
+            if end - first > 1:
+                best.append(first + int(np.argmax(scores[offset:offset + end - first])))
+                offset += end - first
+            else:
+                best.append(first)
+        return best
 
-        self.document_content[document_id] = {
-            "text": text,
-            "sentences": sentences
+    def corpus_changed(self):
+        """Invalidate cached answers after documents were added or removed"""
+        self.corpus_version += 1
+        self.answers.clear()
+
+    @staticmethod
+    def normalize_question(question):
+        """Lowercase a question and collapse its whitespace, for use as a cache key"""
+        return re.sub(r'\s+', ' ', question).strip().lower()
+
+    def stats(self):
+        """Return cache and batching statistics"""
+        return {
+            "encoder": self._encoder.backend if self._encoder else None,
+            "corpus_version": self.corpus_version,
+            "documents": len(self.documents),
+            "answer_cache": self.answers.stats(),
+            "question_embedding_cache": self.question_embeddings.stats(),
+            "sentence_embedding_cache": self.embedding_cache.stats(),
+            "residency": dict(self.residency.stats(), removed_rows=self.store.catalog.get("removed_rows", 0)),
+            "query_batching": self.query_encoder.stats()
         }
 
-        self.document_embeddings[document_id] = embeddings
+    def get_page(self, doc_id, idx):
+        """Return the 1-based PDF page a row starts on, or None if unknown"""
+        page = int(self.store.pages()[self.index.doc_ranges[doc_id][0] + idx])
+        return page or None
+
+    def search(self, question, question_embedding, k=10, doc_ids=None):
+        """Return the top-k (doc_id, row_idx, similarity) matches for a question
+
+        The similarity is always the embedding cosine similarity; the keyword
+        index only changes which sentences are considered and how they rank.
+        """
+        if self.retrieval_mode == "dense":
+            return self.index.search(question_embedding, k, doc_ids)
+
+        lexical_rows, lexical_scores = self.keyword_search(question, doc_ids)
+
+        if self.retrieval_mode == "prefilter":
+            # Only embed-score the sentences with the best keyword matches,
+            # unless no sentence shares a keyword with the question
+            candidates, _ = top_rows(lexical_rows, lexical_scores, self.lexical_candidates)
+            if len(candidates) == 0:
+                return self.index.search(question_embedding, k, doc_ids)
+            return self.index.search(question_embedding, k, doc_ids, rows=np.sort(candidates))
+
+        dense_rows, _ = self.index.search_rows(question_embedding, self.lexical_candidates, doc_ids)
+        return self._fuse(question_embedding, dense_rows, lexical_rows, lexical_scores, k)
+
+    def iter_search(self, question, question_embedding, k=10, doc_ids=None):
+        """Yield the top-k matches among the sentences searched so far, as search() returns them
+
+        Only dense and hybrid searches are progressive; the last result is
+        always the same as search()'s.
+        """
+        if self.retrieval_mode == "dense":
+            for rows, similarities in self.index.iter_search_rows(question_embedding, k, doc_ids):
+                yield self.index.locate(rows, similarities)
+        elif self.retrieval_mode == "prefilter":
+            yield self.search(question, question_embedding, k, doc_ids)
+        else:
+            lexical_rows, lexical_scores = self.keyword_search(question, doc_ids)
+            for dense_rows, _ in self.index.iter_search_rows(question_embedding, self.lexical_candidates, doc_ids):
+                yield self._fuse(question_embedding, dense_rows, lexical_rows, lexical_scores, k)
+
+    def keyword_search(self, question, doc_ids=None):
+        """Return (rows, scores) of the selected rows sharing a term with the question, rows ascending"""
+        lexical_rows, lexical_scores = self.lexical.scores(question)
+        selected = np.isin(lexical_rows, self.index.select_rows(lexical_rows, doc_ids))
+        return lexical_rows[selected], lexical_scores[selected]
+
+    def _fuse(self, question_embedding, dense_rows, lexical_rows, lexical_scores, k):
+        """Rank the best embedding and keyword matches together for hybrid search
+
+        Candidates are rescored with a weighted sum of cosine similarity and
+        keyword score (scaled to the best keyword match).
+        """
+        keyword_rows, _ = top_rows(lexical_rows, lexical_scores, self.lexical_candidates)
+        candidates = np.union1d(dense_rows, keyword_rows)
+        if len(candidates) == 0:
+            return []
 
-        print(f"Document processed successfully! ID: {document_id}")
-        return document_id
+        similarities = self.index.score_rows(question_embedding, candidates)
+        keyword_scores = np.zeros(len(candidates), dtype=np.float32)
+        if len(lexical_rows):
+            positions = np.minimum(np.searchsorted(lexical_rows, candidates), len(lexical_rows) - 1)
+            found = lexical_rows[positions] == candidates
+            keyword_scores[found] = lexical_scores[positions[found]] / lexical_scores.max()
+
+        fused = (1 - self.hybrid_weight) * similarities + self.hybrid_weight * keyword_scores
+        top = np.argsort(-fused, kind="stable")[:k]
+        return self.index.locate(candidates[top], similarities[top])
+
+    def _answer_cache_key(self, question, doc_ids):
+        return (
+            self.normalize_question(question),
+            tuple(sorted(doc_ids)) if doc_ids else None,
+            self.corpus_version
+        )
 
     def ask_question(self, question, doc_ids=None):
-        """Answer a question based on document content with improved context understanding"""
-        if not doc_ids:
-            doc_ids = list(self.documents.keys())  # Use all documents if none specified
+        """Answer a question, serving repeated questions from the answer cache"""
+        self.refresh()
+        cache_key = self._answer_cache_key(question, doc_ids)
+        answer = self.answers.get(cache_key)
+        if answer is None:
+            self.questions.inc(cache="miss")
+            answer = self._answer_question(question, doc_ids)
+            self.answers.put(cache_key, answer)
+        else:
+            self.questions.inc(cache="hit")
+        return dict(answer)
 
-        if not doc_ids:
-            return {
-                "answer": "No documents have been loaded yet.",
-                "confidence": 0.0,
-                "source_document": "",
-                "source_text": ""
-            }
+    def stream_answer(self, question, doc_ids=None):
+        """Answer a question step by step, yielding (event, data) pairs
+
+        "sources" events list the best matches found so far: keyword matches
+        first, which need no embedding, then the ranked matches as blocks of
+        the corpus are scored. The last event is always "answer".
+        """
+        self.refresh()
+        cache_key = self._answer_cache_key(question, doc_ids)
+        answer = self.answers.get(cache_key)
+        if answer is not None:
+            self.questions.inc(cache="hit")
+            yield "answer", dict(answer)
+            return
+        self.questions.inc(cache="miss")
 
-        print(f"Answering question: {question}")
-        print(f"Searching across {len(doc_ids)} documents")
+        if not doc_ids and not self.documents:
+            yield "answer", self._answer_question(question, doc_ids)
+            return
+        search_doc_ids = doc_ids or None
+        # A search of every document streams through all rows without keeping
+        # them; only the documents the answer comes from count as used
+        if doc_ids:
+            self._use_documents(doc_ids, prefetch=True)
+
+        logger.debug("Answering question: %s", question)
+        timer = StageTimer()
+        if self.retrieval_mode != "dense":
+            with timer.stage("score"):
+                rows, _ = top_rows(*self.keyword_search(question, search_doc_ids), 10)
+            if len(rows):
+                with timer.stage("format"):
+                    sources = self.describe_matches(self.index.locate(rows, np.zeros(len(rows))), ranked=False)
+                yield "sources", sources
+
+        with timer.stage("embed"):
+            question_embedding = self._embed_question(question)
+        all_matches = []
+        for all_matches in timer.iterate("score", self.iter_search(question, question_embedding, k=10,
+                                                                    doc_ids=search_doc_ids)):
+            with timer.stage("format"):
+                sources = self.describe_matches(all_matches)
+            yield "sources", sources
 
+        with timer.stage("format"):
+            answer = self._compose_answer(question, question_embedding, all_matches)
+        self._use_documents(dict.fromkeys(doc_id for doc_id, _, _ in all_matches))
+        self.answers.put(cache_key, answer)
+        timer.observe(self.query_stage_seconds)
+        yield "answer", dict(answer)
+
+    def describe_matches(self, matches, ranked=True):
+        """Turn (doc_id, row_idx, similarity) matches into JSON-friendly source descriptions
+
+        Unranked matches (keyword matches shown before ranking) have no similarity.
+        """
+        return [{
+            "document": self.documents[doc_id]["filename"],
+            "page": self.get_page(doc_id, idx),
+            "text": self.get_text(doc_id, idx),
+            "similarity": similarity if ranked else None
+        } for doc_id, idx, similarity in matches]
+
+    def _embed_question(self, question):
+        """Return the embedding a question is searched with, from the cache if possible"""
         # Enhance the question for better matching
         enhanced_question = question
 
@@ -243,82 +1371,74 @@ class DocumentChatbot:
         if any(phrase in question.lower() for phrase in ["main topic", "about", "summary", "overview", "purpose"]):
             enhanced_question = "This document discusses or summarizes the following topic:"
 
-        # Generate embedding for question
-        question_embedding = self.generate_embedding(enhanced_question)[0]  # Remove batch dimension
-
-        # Track top matches
-        all_matches = []
-
-        # Search through specified documents
-        for doc_id in doc_ids:
-            if doc_id not in self.document_embeddings or not self.document_embeddings[doc_id]:
-                continue
-
-            # Calculate similarity with each sentence in the document
-            doc_embeddings = self.document_embeddings[doc_id]
-            doc_sentences = self.document_content[doc_id]["sentences"]
+        # Generate embedding for question. The models are uncased, so questions
+        # differing only in case or spacing share an embedding.
+        embedding_key = self.normalize_question(enhanced_question)
+        question_embedding = self.question_embeddings.get(embedding_key)
+        if question_embedding is None:
+            question_embedding = self.query_encoder.encode(enhanced_question)
+            self.question_embeddings.put(embedding_key, question_embedding)
+        return question_embedding
 
-            # Check if we have valid data
-            if not doc_embeddings or len(doc_embeddings) != len(doc_sentences):
-                print(f"Warning: Document {doc_id} has mismatched data. Using available data.")
-                # Use the smaller length to avoid index errors
-                min_length = min(len(doc_embeddings), len(doc_sentences))
-                doc_embeddings = doc_embeddings[:min_length]
-                doc_sentences = doc_sentences[:min_length]
+    def _answer_question(self, question, doc_ids=None):
+        """Answer a question based on document content with improved context understanding"""
+        search_all = not doc_ids
+        if not doc_ids:
+            doc_ids = list(self.documents.keys())  # Use all documents if none specified
 
-            if not doc_embeddings:
-                continue
+        if not doc_ids:
+            return {
+                "answer": "No documents have been loaded yet.",
+                "confidence": 0.0,
+                "source_document": "",
+                "source_text": "",
+                "source_page": None
+            }
 
-            try:
-                similarities = cosine_similarity(
-                    [question_embedding],
-                    doc_embeddings
-                )[0]
+        logger.debug("Answering question: %s", question)
+        logger.debug("Searching across %d documents", len(doc_ids))
 
-                # Get top 10 matches for this document
-                top_indices = similarities.argsort()[-10:][::-1]
-                
-                for idx in top_indices:
-                    if idx < len(doc_sentences):
-                        sentence = doc_sentences[idx]
-                        similarity = similarities[idx]
-                        
-                        # Get context (sentences before and after)
-                        start_idx = max(0, idx - 2)
-                        end_idx = min(len(doc_sentences), idx + 3)
-                        context_sentences = doc_sentences[start_idx:end_idx]
-                        context = " ".join(context_sentences)
-                        
-                        all_matches.append({
-                            "sentence": sentence,
-                            "context": context,
-                            "similarity": similarity,
-                            "doc_id": doc_id
-                        })
-                        
-            except Exception as e:
-                print(f"Error processing document {doc_id}: {e}")
+        # Find the best matching sentences across all selected documents
+        timer = StageTimer()
+        if not search_all:
+            self._use_documents(doc_ids, prefetch=True)
+        with timer.stage("embed"):
+            question_embedding = self._embed_question(question)
+        with timer.stage("score"):
+            all_matches = self.search(question, question_embedding, k=10,
+                                      doc_ids=None if search_all else doc_ids)
+        with timer.stage("format"):
+            answer = self._compose_answer(question, question_embedding, all_matches)
+        # The documents the answer came from stay resident longest
+        self._use_documents(dict.fromkeys(doc_id for doc_id, _, _ in all_matches))
+        timer.observe(self.query_stage_seconds)
+        return answer
 
-        # Sort all matches by similarity
-        all_matches.sort(key=lambda x: x["similarity"], reverse=True)
-        
+    def _compose_answer(self, question, question_embedding, all_matches):
+        """Build the answer to a question from its best (doc_id, row_idx, similarity) matches"""
         # No matches found
         if not all_matches:
             return {
                 "answer": "I couldn't find a relevant answer to your question in the provided documents.",
                 "confidence": 0.0,
                 "source_document": "",
-                "source_text": ""
+                "source_text": "",
+                "source_page": None
             }
-        
-        best_match = all_matches[0]
-        best_doc_id = best_match["doc_id"]
-        best_similarity = best_match["similarity"]
-        
+
+        # Answers quote single sentences; only the best one needs its surrounding context
+        sentences = self.best_sentences(all_matches[:5], question_embedding)
+        best_doc_id, best_idx, best_similarity = all_matches[0]
+        best_context = self.get_context(best_doc_id, best_idx, sentences[0])
+        best_page = self.get_page(best_doc_id, best_idx)
+
         # For topic/purpose questions, generate a more comprehensive answer
         if any(phrase in question.lower() for phrase in ["main topic", "about", "summary", "overview", "purpose"]):
             # Use the top 3-5 matches to form a response
-            top_matches = all_matches[:5]
+            top_matches = [
+                {"sentence": self.get_sentences(doc_id)[sentence]}
+                for (doc_id, _, _), sentence in zip(all_matches[:5], sentences)
+            ]
             
             # Extract document title/name
             doc_name = self.documents[best_doc_id]["filename"]
@@ -359,7 +1479,8 @@ class DocumentChatbot:
                 "answer": answer,
                 "confidence": float(best_similarity),
                 "source_document": self.documents[best_doc_id]["filename"],
-                "source_text": best_match["context"]
+                "source_text": best_context,
+                "source_page": best_page
             }
                 
         # For regular questions, use the best match and its context
@@ -368,17 +1489,122 @@ class DocumentChatbot:
                 "answer": "I couldn't find a specific answer to your question. Try asking a more specific question about the document content.",
                 "confidence": best_similarity,
                 "source_document": self.documents[best_doc_id]["filename"] if best_doc_id else "",
-                "source_text": ""
+                "source_text": "",
+                "source_page": None
             }
         
         # For all other questions, provide the context as the answer
         return {
-            "answer": best_match["context"],
+            "answer": best_context,
             "confidence": float(best_similarity),
             "source_document": self.documents[best_doc_id]["filename"],
-            "source_text": best_match["context"]
+            "source_text": best_context,
+            "source_page": best_page
         }
 
     def list_documents(self):
         """List all loaded documents"""
-        return list(self.documents.values())
\ No newline at end of file
+        self.refresh()
+        return list(self.documents.values())
+
+
+def configure_logging():
+    """Send log records to stderr at LOG_LEVEL (default INFO), tagged with the process id"""
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+                        format="%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s")
+
+
+def find_pdfs(directory):
+    """Return the paths of all PDFs under a directory, sorted"""
+    paths = []
+    for root, _, names in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in names if name.lower().endswith(".pdf"))
+    return sorted(paths)
+
+
+def embedding_parity(chatbot, texts, batch_size=None):
+    """Return the cosine similarity of each text's batched embedding to its embedding alone
+
+    Batches pad their shorter texts and padding is masked out, so the two
+    should only differ by rounding.
+    """
+    batched = chatbot.generate_embeddings(texts, batch_size=batch_size)
+    single = chatbot.generate_embeddings(texts, batch_size=1)
+    norms = np.linalg.norm(batched, axis=1) * np.linalg.norm(single, axis=1)
+    return np.sum(batched * single, axis=1) / np.maximum(norms, 1e-12)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Document chatbot command line tools")
+    commands = parser.add_subparsers(dest="command")
+    ingest_parser = commands.add_parser(
+        "ingest", help="index every PDF under a directory, skipping files that are already indexed")
+    ingest_parser.add_argument("directory")
+    parity_parser = commands.add_parser(
+        "check-embeddings", help="check that batched embeddings match texts embedded one at a time")
+    parity_parser.add_argument("--sentences", help="text file with one text per line (default: built-in samples)")
+    parity_parser.add_argument("--batch-size", type=int, help="default: EMBEDDING_BATCH_SIZE")
+    parity_parser.add_argument("--min-cosine", type=float, default=0.999)
+    args = parser.parse_args()
+    if args.command not in ("ingest", "check-embeddings"):
+        parser.print_help()
+        sys.exit(2)
+
+    configure_logging()
+    if args.command == "check-embeddings":
+        if args.sentences:
+            with open(args.sentences, "r", encoding="utf-8") as f:
+                samples = [line.strip() for line in f if line.strip()]
+        else:
+            # Texts of many lengths, so batches hold plenty of padding
+            samples = SAMPLE_SENTENCES + [" ".join(SAMPLE_SENTENCES[:count])
+                                          for count in range(2, len(SAMPLE_SENTENCES) + 1)]
+        chatbot = DocumentChatbot()
+        cosines = embedding_parity(chatbot, samples, args.batch_size)
+        print(f"{len(samples)} texts in batches of {args.batch_size or chatbot.embedding_batch_size}: "
+              f"min cosine {cosines.min():.6f}, mean {cosines.mean():.6f}")
+        if cosines.min() < args.min_cosine:
+            sys.exit(f"Batched embeddings differ from unbatched ones (cosine < {args.min_cosine})")
+        sys.exit(0)
+
+    paths = find_pdfs(args.directory)
+    logger.info("Found %d PDFs in %s", len(paths), args.directory)
+
+    # The model is only loaded once some file actually needs embedding
+    os.environ.setdefault("MODEL_LOADING", "lazy")
+    chatbot = DocumentChatbot()
+
+    started = time.monotonic()
+    last_report = 0.0
+
+    counts = {}
+
+    def report(stage, **progress):
+        global last_report
+        counts.update(progress)
+        files_total, files_indexed, files_unchanged, files_deleted, files_failed, rows_embedded = (
+            progress["files_total"], progress["files_indexed"], progress["files_unchanged"],
+            progress["files_deleted"], progress["files_failed"], progress["rows_embedded"])
+        done = files_indexed + files_unchanged + files_deleted + files_failed
+        now = time.monotonic()
+        if now - last_report < 5 and done < files_total:
+            return
+        last_report = now
+
+        elapsed = max(now - started, 1e-9)
+        processed = files_indexed + files_failed
+        eta = ""
+        if processed and done < files_total:
+            eta = f", about {(files_total - done) * elapsed / processed / 60:.0f} min left"
+        logger.info("%d/%d files: %d indexed, %d unchanged, %d deleted, %d failed; %d rows embedded (%.0f/s)%s",
+                    done, files_total, files_indexed, files_unchanged, files_deleted, files_failed,
+                    rows_embedded, rows_embedded / elapsed, eta)
+        # The server's /metrics includes this run
+        chatbot.metrics.sync()
+
+    doc_ids = chatbot.ingest_files(paths, progress=report)
+    chatbot.metrics.sync(force=True)
+    failed = counts["files_failed"]
+    logger.info("Done in %.0fs; %d of %d PDFs are indexed", time.monotonic() - started,
+                len(doc_ids) - doc_ids.count(None), len(doc_ids))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,148 @@
+import sys
+import time
+import argparse
+from itertools import islice
+import numpy as np
+
+
+class TokenChunker:
+    """Packs consecutive sentences into overlapping chunks of at most `max_tokens` tokens
+
+    Each chunk is embedded as one vector, so a document gets fewer, denser
+    vectors than with one vector per sentence, and no chunk is longer than the
+    model reads. Neighbouring chunks share `overlap` sentences, so a passage
+    that straddles a chunk boundary still appears whole in one of them.
+    Sentence lengths are measured with the model's own tokenizer.
+    """
+
+    def __init__(self, tokenizer, max_tokens=128, overlap=1, batch_size=256):
+        self.tokenizer = tokenizer
+        # Room for the [CLS] and [SEP] tokens the model adds
+        self.budget = max(1, max_tokens - 2)
+        self.overlap = overlap
+        self.batch_size = batch_size
+
+    def token_counts(self, sentences):
+        """Return the number of tokens in each sentence"""
+        encoded = self.tokenizer(sentences, add_special_tokens=False, truncation=True, max_length=512)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def iter_chunks(self, segments):
+        """Turn (sentence, page_number) pairs into (sentences, first_index, page_number) chunks
+
+        first_index is the position of the chunk's first sentence in the
+        document and page_number the page it is on. Sentences are tokenized a
+        batch at a time and chunks are yielded as soon as they are full.
+        """
+        segments = iter(segments)
+        window = []  # (sentence, page_number, tokens) of the chunk being filled
+        window_tokens = 0
+        first_index = 0
+
+        while True:
+            batch = list(islice(segments, self.batch_size))
+            if not batch:
+                break
+            counts = self.token_counts([sentence for sentence, _ in batch])
+            for (sentence, page_number), tokens in zip(batch, counts):
+                if window and window_tokens + tokens > self.budget:
+                    yield [entry[0] for entry in window], first_index, window[0][1]
+
+                    # The next chunk starts with the last sentences of this one,
+                    # as far as they leave room for the new sentence
+                    keep = window[len(window) - self.overlap:] if self.overlap else []
+                    while keep and sum(entry[2] for entry in keep) + tokens > self.budget:
+                        keep.pop(0)
+                    first_index += len(window) - len(keep)
+                    window = keep
+                    window_tokens = sum(entry[2] for entry in window)
+
+                window.append((sentence, page_number, tokens))
+                window_tokens += tokens
+
+        if window:
+            yield [entry[0] for entry in window], first_index, window[0][1]
+
+
+def evaluate(encoder, tokenizer, rows, spans, sentences, num_queries=200, k=5, seed=0):
+    """Return hit@1 and hit@k of finding sentences from a shortened copy of them
+
+    Each query is a sentence with a third of its words dropped; a hit means
+    one of the top rows covers the original sentence.
+    """
+    rng = np.random.default_rng(seed)
+    candidates = [i for i, sentence in enumerate(sentences) if len(sentence.split()) >= 6]
+    picked = rng.choice(candidates, min(num_queries, len(candidates)), replace=False)
+
+    queries = []
+    for i in picked:
+        words = sentences[i].split()
+        keep = np.sort(rng.choice(len(words), len(words) - len(words) // 3, replace=False))
+        queries.append(" ".join(words[j] for j in keep))
+    query_vectors = encode(encoder, tokenizer, queries)
+
+    hits_at_1 = hits_at_k = 0
+    for i, query in zip(picked, query_vectors):
+        top = np.argsort(-(rows @ query))[:k]
+        covered = [spans[row][0] <= i < spans[row][1] for row in top]
+        hits_at_1 += covered[0]
+        hits_at_k += any(covered)
+    return hits_at_1 / len(picked), hits_at_k / len(picked)
+
+
+def encode(encoder, tokenizer, texts, batch_size=32):
+    """Embed texts with an encoder from encoders.py and normalize them"""
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        inputs = tokenizer(texts[start:start + batch_size], padding=True, truncation=True,
+                           max_length=512, return_tensors="pt")
+        vectors.append(encoder(inputs["input_ids"], inputs["attention_mask"]))
+    vectors = np.concatenate(vectors)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare sentence rows with token-budget chunks")
+    parser.add_argument("pdfs", nargs="+")
+    parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--max-tokens", type=int, nargs="+", default=[128, 256])
+    parser.add_argument("--overlap", type=int, default=1)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    from transformers import AutoTokenizer, AutoModel
+    from chatbot import SimpleTokenizer, iter_page_range
+    from encoders import load_encoder
+    import PyPDF2
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    encoder = load_encoder("eager", AutoModel.from_pretrained(args.model), tokenizer)
+
+    segments = []
+    for path in args.pdfs:
+        with open(path, "rb") as f:
+            num_pages = len(PyPDF2.PdfReader(f).pages)
+        segments.extend(SimpleTokenizer.iter_sentences(iter_page_range(path, 0, num_pages)))
+    sentences = [sentence for sentence, _ in segments]
+    if not sentences:
+        sys.exit("No text could be extracted")
+
+    print(f"{len(sentences)} sentences from {len(args.pdfs)} PDFs")
+    print(f"{'rows':>16} {'vectors':>8} {'index MB':>9} {'embed s':>8} {'hit@1':>6} {'hit@5':>6}")
+    modes = [("sentences", None)] + [(f"chunks <= {n}", n) for n in args.max_tokens]
+    for label, max_tokens in modes:
+        start = time.perf_counter()
+        if max_tokens is None:
+            texts = sentences
+            spans = [(i, i + 1) for i in range(len(sentences))]
+        else:
+            chunker = TokenChunker(tokenizer, max_tokens, args.overlap)
+            chunks = list(chunker.iter_chunks(segments))
+            texts = [" ".join(chunk) for chunk, _, _ in chunks]
+            spans = [(first, first + len(chunk)) for chunk, first, _ in chunks]
+        rows = encode(encoder, tokenizer, texts)
+        seconds = time.perf_counter() - start
+
+        hit_at_1, hit_at_5 = evaluate(encoder, tokenizer, rows, spans, sentences, args.queries)
+        print(f"{label:>16} {len(rows):>8} {rows.nbytes / 2**20:>9.2f} {seconds:>8.1f} "
+              f"{hit_at_1:>6.3f} {hit_at_5:>6.3f}")
@@ -0,0 +1,558 @@
+import os
+import io
+import json
+import logging
+import mmap
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+import numpy as np
+from vector_index import normalize_rows
+from quantization import STORAGE_DTYPES, quantize
+
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows: the lock only covers threads of one process
+    fcntl = None
+
+
+def _advise_file(path, offset, length, advice):
+    """Pass a posix_fadvise() hint for length bytes of a file from offset (0 = to the end)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class DocumentStore:
+    """Persistent on-disk store for document sentences and embeddings
+
+    All sentence embeddings live in a single append-only float32 file that is
+    opened with np.memmap, so reattaching to a corpus only maps the file and
+    every process reading it shares the same page cache. Embeddings are stored
+    unit-normalized. A row is a chunk of one or more consecutive sentences;
+    row-aligned int32 files record the PDF page each row starts on (0 when
+    unknown) and the [first, end) range of sentences it covers. Each
+    document's sentences are kept in one file of UTF-8 text and offsets (see
+    SentenceBuffer) that is memory-mapped when first needed.
+
+    Compact int8 copies of the embeddings (see quantization.py) are
+    derived from the float32 file on request and kept next to it.
+
+    Several processes (e.g. gunicorn workers) can share one store. Writers
+    hold a file lock, and every commit bumps the catalog's generation counter;
+    readers call reload() to notice it and map the grown files.
+
+    Removing a document drops it from the catalog and deletes its sentences;
+    its rows stay in the row-aligned files, unused, since those only grow.
+    The fingerprints of deleted documents are remembered (see deleted) until
+    the same content is committed again.
+    """
+
+    def __init__(self, data_dir, dim):
+        self.data_dir = data_dir
+        self.catalog_path = os.path.join(data_dir, "catalog.json")
+        self.lock_path = os.path.join(data_dir, "store.lock")
+        self.embeddings_path = os.path.join(data_dir, "embeddings.f32")
+        self.pages_path = os.path.join(data_dir, "pages.i32")
+        self.spans_path = os.path.join(data_dir, "spans.i32")
+        self.sentences_dir = os.path.join(data_dir, "sentences")
+        self.tmp_dir = os.path.join(data_dir, "tmp")
+        os.makedirs(self.sentences_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._remove_stale_tmp_files()
+
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_file = None
+
+        self._catalog_signature = None
+        self.catalog = self._read_catalog(dim)
+        self._matrix = None
+        self._pages = None
+        self._spans = None
+        self._quantized = {}  # storage kind -> (codes, scales) memory maps
+
+        # Stores written before embeddings were normalized get upgraded once
+        if not self.catalog.get("normalized"):
+            with self.locked():
+                self.reload()
+                if not self.catalog.get("normalized"):
+                    self._normalize_stored_embeddings()
+
+    @property
+    def dim(self):
+        return self.catalog["dim"]
+
+    @property
+    def rows(self):
+        return self.catalog["rows"]
+
+    @property
+    def documents(self):
+        return self.catalog["documents"]
+
+    @property
+    def deleted(self):
+        """SHA-256 -> path of the files of deleted documents"""
+        return self.catalog.get("deleted", {})
+
+    @property
+    def generation(self):
+        return self.catalog["generation"]
+
+    def _stat_catalog(self):
+        """Return what identifies the current catalog file, or None if there is none"""
+        try:
+            stat = os.stat(self.catalog_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _read_catalog(self, dim):
+        """Load the catalog, or start an empty one"""
+        self._catalog_signature = self._stat_catalog()
+        if self._catalog_signature is not None:
+            with open(self.catalog_path, "r", encoding="utf-8") as f:
+                catalog = json.load(f)
+            if catalog["dim"] != dim:
+                raise ValueError(
+                    f"Stored embeddings have dimension {catalog['dim']}, model produces {dim}"
+                )
+            catalog.setdefault("generation", 0)
+            for info in catalog["documents"].values():
+                # Stores written before chunking have one row per sentence
+                info.setdefault("num_rows", info["num_sentences"])
+            return catalog
+
+        return {"dim": dim, "rows": 0, "normalized": True, "generation": 0, "documents": {}}
+
+    def _write_catalog(self):
+        """Atomically replace the catalog file"""
+        tmp_path = self.catalog_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.catalog, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.catalog_path)
+        self._catalog_signature = self._stat_catalog()
+
+    def reload(self):
+        """Re-read the catalog if another process has committed since; returns True if so"""
+        if self._stat_catalog() == self._catalog_signature:
+            return False
+        catalog = self._read_catalog(self.dim)
+        changed = catalog["generation"] != self.catalog["generation"]
+        self.catalog = catalog
+        return changed
+
+    @contextmanager
+    def locked(self):
+        """Hold the store's write lock, which every process sharing the store respects
+
+        Reentrant within a process. Writers should reload() once they hold it.
+        """
+        with self._lock:
+            if self._lock_depth == 0:
+                self._lock_file = open(self.lock_path, "a")
+                if fcntl:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    # Closing the file releases the lock
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def _normalize_stored_embeddings(self, chunk_rows=65536):
+        """Rewrite the embedding file in place with unit-length rows"""
+        if self.rows:
+            logger.info("Normalizing stored embeddings...")
+            matrix = np.memmap(self.embeddings_path, dtype=np.float32,
+                               mode="r+", shape=(self.rows, self.dim))
+            for start in range(0, self.rows, chunk_rows):
+                matrix[start:start + chunk_rows] = normalize_rows(matrix[start:start + chunk_rows])
+            matrix.flush()
+            del matrix
+
+        self.catalog["normalized"] = True
+        self._write_catalog()
+
+    def _remove_stale_tmp_files(self, max_age=24 * 3600):
+        """Delete leftovers of ingestion jobs that never finished"""
+        for name in os.listdir(self.tmp_dir):
+            path = os.path.join(self.tmp_dir, name)
+            try:
+                if time.time() - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _sentences_path(self, doc_id):
+        return os.path.join(self.sentences_dir, f"{doc_id}.bin")
+
+    def embeddings(self):
+        """Return a read-only memory map over every stored embedding"""
+        if self._matrix is None or len(self._matrix) != self.rows:
+            if self.rows == 0:
+                self._matrix = np.zeros((0, self.dim), dtype=np.float32)
+            else:
+                self._matrix = np.memmap(self.embeddings_path, dtype=np.float32,
+                                         mode="r", shape=(self.rows, self.dim))
+        return self._matrix
+
+    def pages(self):
+        """Return a read-only memory map of the page number of every row"""
+        if self._pages is None or len(self._pages) != self.rows:
+            if self.rows == 0 or not os.path.exists(self.pages_path):
+                # Stores written before page tracking have no page numbers
+                self._pages = np.zeros(self.rows, dtype=np.int32)
+            else:
+                self._pages = np.memmap(self.pages_path, dtype=np.int32,
+                                        mode="r", shape=(self.rows,))
+        return self._pages
+
+    def spans(self):
+        """Return a read-only memory map of the [first, end) sentence range of every row
+
+        Sentence indices are relative to the row's document. Rows written
+        before spans were recorded read as (0, 0).
+        """
+        if self._spans is None or len(self._spans) != self.rows:
+            if self.rows == 0 or not os.path.exists(self.spans_path):
+                self._spans = np.zeros((self.rows, 2), dtype=np.int32)
+            else:
+                self._spans = np.memmap(self.spans_path, dtype=np.int32,
+                                        mode="r", shape=(self.rows, 2))
+        return self._spans
+
+    def document_spans(self, doc_id):
+        """Return the sentence range of every row of a document, as an (n, 2) array"""
+        info = self.documents[doc_id]
+        start = info["row_start"]
+        spans = np.array(self.spans()[start:start + info["num_rows"]])
+        # Rows without a recorded span hold the sentence with their own index
+        legacy = np.flatnonzero(spans[:, 1] == 0)
+        spans[legacy, 0] = legacy
+        spans[legacy, 1] = legacy + 1
+        return spans
+
+    def quantized(self, kind, chunk_rows=65536):
+        """Return (codes, scales) memory maps of the embeddings stored as int8
+
+        Rows added since the last call are quantized first.
+        """
+        codes_path = os.path.join(self.data_dir, f"embeddings.{kind}")
+        scales_path = os.path.join(self.data_dir, "scales.f32") if kind == "int8" else None
+        row_bytes = self.dim * np.dtype(STORAGE_DTYPES[kind]).itemsize
+
+        def quantized_rows():
+            """Rows already quantized by an earlier call, or another process"""
+            done = os.path.getsize(codes_path) // row_bytes if os.path.exists(codes_path) else 0
+            if scales_path:
+                done = min(done, os.path.getsize(scales_path) // 4 if os.path.exists(scales_path) else 0)
+            return min(done, self.rows)
+
+        if quantized_rows() < self.rows:
+            with self.locked():
+                matrix = self.embeddings()
+                for start in range(quantized_rows(), self.rows, chunk_rows):
+                    codes, scales = quantize(matrix[start:start + chunk_rows], kind)
+                    self._append_rows(codes_path, row_bytes, start, io.BytesIO(codes.tobytes()))
+                    if scales_path:
+                        self._append_rows(scales_path, 4, start, io.BytesIO(scales.tobytes()))
+
+        cached = self._quantized.get(kind)
+        if cached is None or len(cached[0]) != self.rows:
+            if self.rows == 0:
+                codes = np.zeros((0, self.dim), dtype=STORAGE_DTYPES[kind])
+                scales = np.zeros(0, dtype=np.float32) if scales_path else None
+            else:
+                codes = np.memmap(codes_path, dtype=STORAGE_DTYPES[kind],
+                                  mode="r", shape=(self.rows, self.dim))
+                scales = np.memmap(scales_path, dtype=np.float32, mode="r",
+                                   shape=(self.rows,)) if scales_path else None
+            self._quantized[kind] = (codes, scales)
+        return self._quantized[kind]
+
+    def _advise_rows(self, start, end, advice, file_advice=None):
+        """Pass an madvise() hint for rows [start, end) of every mapped row-aligned file
+
+        With file_advice, a posix_fadvise() hint for the same bytes follows.
+        """
+        if advice is None:
+            # Not available on this platform
+            return
+        arrays = [self._matrix, self._pages, self._spans]
+        for codes, scales in self._quantized.values():
+            arrays += [codes, scales]
+        for array in arrays:
+            mapped = getattr(array, "base", None)
+            if not isinstance(mapped, mmap.mmap):
+                continue
+            row_bytes = array.strides[0]
+            first = start * row_bytes // mmap.PAGESIZE * mmap.PAGESIZE
+            last = min(end * row_bytes, len(mapped))
+            if last > first:
+                try:
+                    mapped.madvise(advice, first, last - first)
+                except (OSError, ValueError):
+                    pass
+                if file_advice is not None and getattr(array, "filename", None):
+                    _advise_file(array.filename, array.offset + first, last - first, file_advice)
+
+    def release_rows(self, start, end):
+        """Drop rows [start, end) from memory; they are read back from disk when next used
+
+        madvise() only unmaps the pages from this process; they stay in the
+        page cache until posix_fadvise() drops them, which the kernel does
+        once no other process maps them either.
+        """
+        self._advise_rows(start, end, getattr(mmap, "MADV_DONTNEED", None),
+                          getattr(os, "POSIX_FADV_DONTNEED", None))
+
+    def release_sentences(self, doc_id):
+        """Drop a document's sentence file from the page cache"""
+        advice = getattr(os, "POSIX_FADV_DONTNEED", None)
+        if advice is not None:
+            _advise_file(self._sentences_path(doc_id), 0, 0, advice)
+
+    def prefetch_rows(self, start, end):
+        """Start reading rows [start, end) into memory ahead of use"""
+        self._advise_rows(start, end, getattr(mmap, "MADV_WILLNEED", None))
+
+    def load_sentences(self, doc_id):
+        """Return a document's sentences as a SentenceBuffer over its file"""
+        path = self._sentences_path(doc_id)
+        legacy_path = os.path.join(self.sentences_dir, f"{doc_id}.jsonl")
+        if not os.path.exists(path) and os.path.exists(legacy_path):
+            # Stores written before sentence buffers kept one JSON line per sentence
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                sentences = [json.loads(line) for line in f]
+            SentenceBuffer.write(path, sentences)
+            os.remove(legacy_path)
+        return SentenceBuffer.open(path)
+
+    def sentences_size(self, doc_id):
+        """Return the size in bytes of a document's sentence file"""
+        try:
+            return os.path.getsize(self._sentences_path(doc_id))
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _append_rows(path, row_bytes, rows, source):
+        """Append the contents of source to a row-aligned file
+
+        Rows the catalog doesn't know about are dropped (an append that never
+        reached the catalog) or zero-filled (rows written before the file
+        existed) first.
+        """
+        with open(path, "ab") as f:
+            expected_size = rows * row_bytes
+            if f.tell() > expected_size:
+                f.truncate(expected_size)
+            elif f.tell() < expected_size:
+                f.write(b"\0" * (expected_size - f.tell()))
+            shutil.copyfileobj(source, f, 1024 * 1024)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def begin_document(self, doc_id):
+        """Start streaming a new document's rows to temporary files"""
+        return DocumentWriter(self, doc_id)
+
+    def commit_document(self, writer, info):
+        """Move a finished document into the store and record it in the catalog
+
+        The caller must hold locked() and have reloaded the catalog since
+        taking it, so the rows are appended after every other process's.
+        """
+        writer.close()
+        with open(writer.embeddings_path, "rb") as source:
+            self._append_rows(self.embeddings_path, self.dim * 4, self.rows, source)
+        with open(writer.pages_path, "rb") as source:
+            self._append_rows(self.pages_path, 4, self.rows, source)
+        with open(writer.spans_path, "rb") as source:
+            self._append_rows(self.spans_path, 8, self.rows, source)
+        os.replace(writer.finish_sentences(), self._sentences_path(info["id"]))
+        writer.abort()
+
+        self.documents[info["id"]] = dict(info, row_start=self.rows, num_rows=writer.rows,
+                                          num_sentences=writer.sentences)
+        # Uploading a deleted document again brings it back
+        self.deleted.pop(info.get("sha256"), None)
+        self.catalog["rows"] += writer.rows
+        self.catalog["generation"] += 1
+        self._write_catalog()
+
+    def update_document(self, doc_id, **fields):
+        """Change fields of a document's catalog entry, such as the size of its file
+
+        The caller must hold locked() and have reloaded the catalog since
+        taking it.
+        """
+        self.documents[doc_id].update(fields)
+        self._write_catalog()
+
+    def remove_document(self, doc_id, deleted=False):
+        """Drop a document from the catalog and delete its sentences
+
+        With deleted=True the document was deleted by the user rather than
+        replaced, and its fingerprint is recorded in deleted. The caller must
+        hold locked() and have reloaded the catalog since taking it.
+        """
+        info = self.documents.pop(doc_id)
+        if deleted and info.get("sha256"):
+            self.catalog.setdefault("deleted", {})[info["sha256"]] = info["path"]
+        self.catalog["removed_rows"] = self.catalog.get("removed_rows", 0) + info["num_rows"]
+        self.catalog["generation"] += 1
+        self._write_catalog()
+        # Readers that still have the file mapped keep their copy until they unmap it
+        for path in (self._sentences_path(doc_id), os.path.join(self.sentences_dir, f"{doc_id}.jsonl")):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class SentenceBuffer:
+    """A document's sentences as one UTF-8 buffer plus an int32 offset array
+
+    On disk this is the sentence count, then count + 1 offsets, then the
+    sentences' text, each followed by a space. Opening the file memory-maps
+    it, so sentences cost no Python objects until they are read, and a run
+    of consecutive sentences joined by spaces is a single slice of the text.
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data  # uint8
+        self.offsets = offsets  # sentence i is data[offsets[i]:offsets[i + 1] - 1]
+
+    @classmethod
+    def open(cls, path):
+        """Memory-map a file written by write() or DocumentWriter"""
+        mapped = np.memmap(path, dtype=np.uint8, mode="r")
+        count = int(mapped[:4].view(np.int32)[0])
+        header_size = 4 * (count + 2)
+        return cls(mapped[header_size:], mapped[4:header_size].view(np.int32))
+
+    @staticmethod
+    def write(path, sentences):
+        """Write sentences to a file that open() can map"""
+        text = "".join(sentence + " " for sentence in sentences).encode("utf-8")
+        lengths = [len(sentence.encode("utf-8")) + 1 for sentence in sentences]
+        offsets = np.zeros(len(sentences) + 1, dtype=np.int32)
+        np.cumsum(lengths, out=offsets[1:])
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.array([len(sentences)], dtype=np.int32).tofile(f)
+            offsets.tofile(f)
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("sentence index out of range")
+        return self.text(i, i + 1)
+
+    def __iter__(self):
+        return (self.text(i, i + 1) for i in range(len(self)))
+
+    def text(self, first, end):
+        """Return sentences [first, end) joined by spaces, decoded straight from the buffer"""
+        first, end = max(first, 0), min(end, len(self))
+        if end <= first:
+            return ""
+        return str(self.data[self.offsets[first]:self.offsets[end] - 1], "utf-8")
+
+
+class DocumentWriter:
+    """Streams one document's sentences, embeddings, pages and spans to temporary files
+
+    Rows are appended batch by batch, so a document never has to be held in
+    memory as a whole. DocumentStore.commit_document() moves them into the
+    store; abort() throws them away.
+    """
+
+    def __init__(self, store, doc_id):
+        prefix = os.path.join(store.tmp_dir, doc_id)
+        self.sentences_path = prefix + ".bin"
+        self.text_path = prefix + ".utf8"
+        self.offsets_path = prefix + ".off"
+        self.embeddings_path = prefix + ".f32"
+        self.pages_path = prefix + ".i32"
+        self.spans_path = prefix + ".spans.i32"
+        self.text_file = open(self.text_path, "wb")
+        self.offsets_file = open(self.offsets_path, "wb")
+        self.offsets_file.write(np.zeros(1, dtype=np.int32).tobytes())
+        self.text_size = 0
+        self.embeddings_file = open(self.embeddings_path, "wb")
+        self.pages_file = open(self.pages_path, "wb")
+        self.spans_file = open(self.spans_path, "wb")
+        self.rows = 0
+        self.sentences = 0
+
+    def append(self, sentences, embeddings, pages, spans=None):
+        """Write a batch of rows; embeddings are normalized on the way
+
+        sentences are the document's sentences that first appear in this
+        batch and spans the [first, end) sentence range of each row. Without
+        spans every row is one of the new sentences.
+        """
+        if spans is None:
+            spans = [(i, i + 1) for i in range(self.sentences, self.sentences + len(sentences))]
+        encoded = [(sentence + " ").encode("utf-8") for sentence in sentences]
+        for text in encoded:
+            self.text_file.write(text)
+        ends = self.text_size + np.cumsum([len(text) for text in encoded], dtype=np.int64)
+        ends.astype(np.int32).tofile(self.offsets_file)
+        self.text_size += sum(len(text) for text in encoded)
+        np.ascontiguousarray(normalize_rows(embeddings), dtype=np.float32).tofile(self.embeddings_file)
+        np.ascontiguousarray(pages, dtype=np.int32).tofile(self.pages_file)
+        np.ascontiguousarray(spans, dtype=np.int32).reshape(-1, 2).tofile(self.spans_file)
+        self.rows += len(embeddings)
+        self.sentences += len(sentences)
+
+    def finish_sentences(self):
+        """Assemble the sentence file (see SentenceBuffer) and return its path"""
+        self.close()
+        with open(self.sentences_path, "wb") as f:
+            np.array([self.sentences], dtype=np.int32).tofile(f)
+            for path in (self.offsets_path, self.text_path):
+                with open(path, "rb") as source:
+                    shutil.copyfileobj(source, f, 1024 * 1024)
+            f.flush()
+            os.fsync(f.fileno())
+        return self.sentences_path
+
+    def close(self):
+        for f in (self.text_file, self.offsets_file, self.embeddings_file, self.pages_file, self.spans_file):
+            f.close()
+
+    def abort(self):
+        """Close and delete whatever temporary files are left"""
+        self.close()
+        for path in (self.sentences_path, self.text_path, self.offsets_path,
+                     self.embeddings_path, self.pages_path, self.spans_path):
+            if os.path.exists(path):
+                os.remove(path)
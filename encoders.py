@@ -0,0 +1,209 @@
+import os
+import sys
+import time
+import logging
+import argparse
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModel
+
+
+logger = logging.getLogger(__name__)
+
+
+def configure_threads(intra_op, inter_op=1):
+    """Set how many threads torch uses within and across operations
+
+    Each gunicorn worker runs its own copy of the model, so the per-worker
+    thread count should be the worker's share of the cores rather than
+    torch's default of all of them.
+    """
+    torch.set_num_threads(intra_op)
+    try:
+        torch.set_num_interop_threads(inter_op)
+    except RuntimeError:
+        # Can only be set once per process, before any parallel work
+        pass
+
+
+class MeanPooledModel(torch.nn.Module):
+    """Wraps a HuggingFace encoder so it returns mean-pooled sentence embeddings"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        hidden = self.model(input_ids=input_ids, attention_mask=attention_mask, return_dict=False)[0]
+        # Average token embeddings, ignoring padding positions
+        mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+        return (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+
+
+class Encoder:
+    """Runs a torch module that maps token ids to sentence embeddings"""
+
+    def __init__(self, backend, module):
+        self.backend = backend
+        self.module = module
+
+    def __call__(self, input_ids, attention_mask):
+        """Return float32 embeddings of shape (batch, dim)"""
+        with torch.inference_mode():
+            return self.module(input_ids, attention_mask).numpy().astype(np.float32)
+
+
+class OnnxEncoder:
+    """Runs the model exported to ONNX in an ONNX Runtime session (needs onnxruntime)"""
+
+    backend = "onnx"
+
+    def __init__(self, model, tokenizer, path):
+        import onnxruntime
+
+        if not os.path.exists(path):
+            logger.info("Exporting encoder to %s...", path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            example = tokenizer(["An example sentence.", "A second, somewhat longer example sentence."],
+                                padding=True, return_tensors="pt")
+            # Workers may export at the same time; each writes its own file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with torch.no_grad():
+                torch.onnx.export(
+                    MeanPooledModel(model), (example["input_ids"], example["attention_mask"]), tmp_path,
+                    input_names=["input_ids", "attention_mask"], output_names=["embeddings"],
+                    dynamic_axes={"input_ids": {0: "batch", 1: "tokens"},
+                                  "attention_mask": {0: "batch", 1: "tokens"},
+                                  "embeddings": {0: "batch"}},
+                    opset_version=14
+                )
+            os.replace(tmp_path, path)
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, input_ids, attention_mask):
+        """Return float32 embeddings of shape (batch, dim)"""
+        return self.session.run(["embeddings"], {
+            "input_ids": input_ids.numpy().astype(np.int64),
+            "attention_mask": attention_mask.numpy().astype(np.int64)
+        })[0].astype(np.float32)
+
+
+BACKENDS = ("eager", "int8", "torchscript", "onnx")
+
+# A traced graph and an ONNX Runtime session start thread pools that don't
+# survive a fork, so these are built in the process that runs them
+FORK_UNSAFE_BACKENDS = ("torchscript", "onnx")
+
+
+def load_encoder(backend, model, tokenizer, onnx_path=None):
+    """Build the encoder for a backend, falling back to eager fp32 if that fails
+
+    eager runs the model as loaded. int8 quantizes the weights of its Linear
+    layers to int8 (activations are quantized on the fly). torchscript traces
+    the model into a frozen graph. onnx runs an exported copy in ONNX Runtime.
+    """
+    model.eval()
+    try:
+        if backend == "eager":
+            return Encoder(backend, MeanPooledModel(model))
+        if backend == "int8":
+            quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            return Encoder(backend, MeanPooledModel(quantized))
+        if backend == "torchscript":
+            example = tokenizer(["An example sentence.", "A second, somewhat longer example sentence."],
+                                padding=True, return_tensors="pt")
+            with torch.no_grad():
+                traced = torch.jit.trace(MeanPooledModel(model).eval(),
+                                         (example["input_ids"], example["attention_mask"]))
+            return Encoder(backend, torch.jit.freeze(traced))
+        if backend == "onnx":
+            return OnnxEncoder(model, tokenizer, onnx_path)
+        raise ValueError(f"Unknown encoder backend: {backend}")
+    except Exception as e:
+        logger.warning("Could not set up the %s encoder (%s), using eager", backend, e)
+        return Encoder("eager", MeanPooledModel(model))
+
+
+SAMPLE_SENTENCES = [
+    "The coursework must be submitted as a single PDF before the deadline.",
+    "Students are expected to deploy the application with Docker.",
+    "This document describes the requirements of the chatbot assignment.",
+    "Bayes-Stein estimation shrinks sample means towards a common value.",
+    "The portfolio weights are chosen to minimize the variance of returns.",
+    "Each section of the report should be no longer than two pages.",
+    "Late submissions will be penalized by ten percent per day.",
+    "The model is evaluated on a held-out test set.",
+    "Figure 3 shows the effect of the shrinkage factor on estimation error.",
+    "Contact the module leader if you have any questions.",
+    "Results are averaged over five runs with different random seeds.",
+    "A brief user manual should explain how to upload documents.",
+]
+
+
+def benchmark(model_name, backends, sentences, batch_size=32, onnx_dir="document_data/onnx"):
+    """Report sentences/sec for each backend and its cosine similarity to eager fp32
+
+    Returns the lowest cosine similarity seen for every backend, the parity
+    check being that it stays at or above 0.99.
+    """
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    batches = [tokenizer(sentences[start:start + batch_size], padding=True, truncation=True,
+                         max_length=512, return_tensors="pt")
+               for start in range(0, len(sentences), batch_size)]
+
+    def encode(encoder):
+        return np.concatenate([encoder(batch["input_ids"], batch["attention_mask"]) for batch in batches])
+
+    reference = None
+    worst = {}
+    print(f"{'backend':>12} {'load s':>8} {'sent/s':>10} {'min cos':>8} {'mean cos':>9}")
+    for backend in backends:
+        start = time.perf_counter()
+        encoder = load_encoder(backend, AutoModel.from_pretrained(model_name), tokenizer,
+                               os.path.join(onnx_dir, model_name.replace("/", "--") + ".onnx"))
+        load_seconds = time.perf_counter() - start
+        if encoder.backend != backend:
+            continue
+
+        encode(encoder)  # Warm up
+        start = time.perf_counter()
+        embeddings = encode(encoder)
+        throughput = len(sentences) / (time.perf_counter() - start)
+
+        if reference is None:
+            reference = encode(load_encoder("eager", AutoModel.from_pretrained(model_name), tokenizer))
+        cosines = np.sum(embeddings * reference, axis=1) / (
+            np.linalg.norm(embeddings, axis=1) * np.linalg.norm(reference, axis=1))
+        worst[backend] = float(cosines.min())
+        print(f"{backend:>12} {load_seconds:>8.1f} {throughput:>10.1f} "
+              f"{cosines.min():>8.4f} {cosines.mean():>9.4f}")
+    return worst
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Encoder backend throughput and parity with eager fp32")
+    parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--sentences", help="text file with one sentence per line (default: built-in samples)")
+    parser.add_argument("--count", type=int, default=512, help="sentences to encode")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    configure_threads(args.threads)
+    if args.sentences:
+        with open(args.sentences, "r", encoding="utf-8") as f:
+            samples = [line.strip() for line in f if line.strip()]
+    else:
+        samples = SAMPLE_SENTENCES
+    samples = [samples[i % len(samples)] for i in range(args.count)]
+
+    results = benchmark(args.model, args.backends, samples, args.batch_size)
+    failed = [backend for backend, cosine in results.items() if cosine < 0.99]
+    if failed:
+        sys.exit(f"Embeddings differ from eager fp32 (cosine < 0.99): {', '.join(failed)}")
@@ -0,0 +1,34 @@
+import gc
+import os
+import sys
+import subprocess
+from metrics import Registry
+
+# Load the app (and the model weights) once in the master process; workers
+# are forked from it and share the weights copy-on-write instead of each
+# loading a private copy. GUNICORN_PRELOAD=0 loads the app in every worker.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+if preload_app:
+    os.environ["PRELOAD_APP"] = "1"
+
+
+def when_ready(server):
+    # Objects that exist before the fork are never collected, so the garbage
+    # collector doesn't write to (and thereby copy) pages shared with workers
+    gc.collect()
+    gc.freeze()
+
+    # /metrics adds up the numbers every process wrote there; start from zero
+    Registry.reset(os.path.join("document_data", "metrics"))
+
+    # Index PDFs already in the upload folder in a separate process, so the
+    # workers answer while they are processed; they pick the documents up
+    # from the shared store as each one is committed
+    if os.environ.get("INGEST_UPLOADS", "1") == "1":
+        subprocess.Popen([sys.executable, "-m", "chatbot", "ingest", "uploads"])
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        import app
+        app.chatbot.start_warmup()
@@ -0,0 +1,180 @@
+import os
+import re
+import json
+import time
+import uuid
+import logging
+import queue
+import threading
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionQueue:
+    """Bounded queue of document ingestion jobs processed by worker threads
+
+    Uploads are turned into jobs that a fixed number of worker threads work
+    through in the background, so a request only has to save the file. When
+    `max_pending` jobs are already waiting, submit() raises queue.Full and the
+    caller should ask the client to retry later.
+
+    If `status_dir` is given, job statuses are also written there, so any
+    process sharing the directory (e.g. another gunicorn worker) can report
+    on a job.
+    """
+
+    def __init__(self, chatbot, workers=1, max_pending=16, max_finished=1000, status_dir=None):
+        self.chatbot = chatbot
+        self.workers = workers
+        self.max_finished = max_finished
+        self.status_dir = status_dir
+        if status_dir:
+            os.makedirs(status_dir, exist_ok=True)
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.jobs = OrderedDict()  # job_id -> job status, oldest first
+        self.lock = threading.Lock()
+        self.threads = []
+        self.pid = None
+
+    def _start_workers(self):
+        """Start the worker threads on first use, again in a forked child that lost them"""
+        if self.threads and self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"ingest-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, file_path, filename):
+        """Queue a document for processing and return its job id"""
+        return self._submit({"filename": filename, "doc_id": None}, file_path)
+
+    def submit_batch(self, file_paths, filenames):
+        """Queue several documents to be indexed together and return the job id"""
+        return self._submit({"filenames": list(filenames), "doc_ids": []}, list(file_paths))
+
+    def _submit(self, fields, target):
+        job_id = str(uuid.uuid4())
+        job = {
+            "id": job_id,
+            **fields,
+            "status": "queued",
+            "stage": "queued",
+            "progress": {},
+            "error": None,
+            "submitted_at": time.time(),
+            "finished_at": None
+        }
+
+        with self.lock:
+            self._start_workers()
+            self.jobs[job_id] = job
+            try:
+                # Raises queue.Full when the backlog is at its limit
+                self.pending.put_nowait((job_id, target))
+            except queue.Full:
+                del self.jobs[job_id]
+                raise
+            self._publish(job)
+            self._prune()
+        return job_id
+
+    def _status_path(self, job_id):
+        return os.path.join(self.status_dir, f"{job_id}.json")
+
+    def _publish(self, job):
+        """Write a job's status for other processes (call with the lock held)"""
+        if not self.status_dir:
+            return
+        tmp_path = self._status_path(job["id"]) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._status_path(job["id"]))
+
+    def get(self, job_id):
+        """Return a snapshot of a job's status, or None if it is unknown"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                return dict(job, progress=dict(job["progress"]))
+
+        # A job submitted to another process
+        if self.status_dir and re.fullmatch(r"[0-9a-f-]{36}", job_id):
+            try:
+                with open(self._status_path(job_id), "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                pass
+        return None
+
+    def _prune(self):
+        """Forget the oldest finished jobs once there are too many"""
+        finished = [job_id for job_id, job in self.jobs.items() if job["finished_at"]]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job_id]
+            if self.status_dir:
+                try:
+                    os.remove(self._status_path(job_id))
+                except OSError:
+                    pass
+
+    def _update(self, job_id, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+            self._publish(self.jobs[job_id])
+
+    def _remove_copies(self, file_paths, doc_ids):
+        """Delete uploaded files that turned out to be copies of a document stored from another file
+
+        Nothing refers to such a file, and bulk ingestion of the upload
+        folder would otherwise hash it again on every start.
+        """
+        for file_path, doc_id in zip(file_paths, doc_ids):
+            document = self.chatbot.documents.get(doc_id)
+            if document is None or os.path.abspath(document["path"]) == os.path.abspath(file_path):
+                continue
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+
+    def _work(self):
+        """Worker loop: process queued jobs one at a time"""
+        while True:
+            job_id, target = self.pending.get()
+            job = self.jobs[job_id]
+
+            def progress(stage, **counts):
+                with self.lock:
+                    job["stage"] = stage
+                    job["progress"].update(counts)
+                    self._publish(job)
+
+            self._update(job_id, status="running", stage="starting")
+            try:
+                if isinstance(target, list):
+                    # A batch is done if any of its documents could be indexed. It was
+                    # uploaded by hand, so documents deleted before are indexed again.
+                    doc_ids = self.chatbot.ingest_files(target, job["filenames"], progress=progress,
+                                                        skip_deleted=False)
+                    result = {"doc_ids": doc_ids} if any(doc_ids) else None
+                    self._remove_copies(target, doc_ids)
+                else:
+                    doc_id = self.chatbot.process_document(target, job["filename"], progress=progress)
+                    result = {"doc_id": doc_id} if doc_id else None
+                    self._remove_copies([target], [doc_id])
+                if result:
+                    self._update(job_id, status="done", stage="done", **result)
+                else:
+                    self._update(job_id, status="failed", stage="failed",
+                                 error="Failed to process document")
+            except Exception as e:
+                logger.exception("Error processing job %s: %s", job_id, e)
+                self._update(job_id, status="failed", stage="failed", error=str(e))
+            finally:
+                self._update(job_id, finished_at=time.time())
+                self.pending.task_done()
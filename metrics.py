@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+# Upper bounds in seconds, as in the Prometheus client libraries
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+               for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """A count that only goes up, kept per combination of label values"""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}  # label values -> count
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(key), value] for key, value in self.values.items()]
+
+    def expose(self, snapshots):
+        """Return the text format lines for the sum of several snapshots"""
+        totals = {}
+        for snapshot in snapshots:
+            for key, value in snapshot:
+                totals[tuple(key)] = totals.get(tuple(key), 0) + value
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}"
+                for key, value in sorted(totals.items())]
+
+
+class Histogram:
+    """Counts observations (such as durations) into buckets, per combination of label values"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}  # label values -> [count per bucket plus one for larger values, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        bucket = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][bucket] += 1
+            entry[1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(key), list(counts), total] for key, (counts, total) in self.values.items()]
+
+    def expose(self, snapshots):
+        """Return the text format lines for the sum of several snapshots"""
+        totals = {}
+        for snapshot in snapshots:
+            for key, counts, total in snapshot:
+                entry = totals.setdefault(tuple(key), [[0] * len(counts), 0.0])
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+
+        lines = []
+        for key, (counts, total) in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, [("le", bound)])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+    def summary(self):
+        """Return {label values: (count, total)} for this process"""
+        with self.lock:
+            return {key: (sum(counts), total) for key, (counts, total) in self.values.items()}
+
+
+class Registry:
+    """The counters and histograms of a process, in the Prometheus text format
+
+    Gunicorn workers are separate processes, each with its own numbers.
+    Given a directory, every process writes its numbers there (see sync())
+    and render() adds up all of them, so a scrape of any worker reports the
+    whole server. Files of exited processes are kept, since their counts
+    are part of the totals.
+    """
+
+    def __init__(self, directory=None, sync_interval=1.0):
+        self.directory = directory
+        self.sync_interval = sync_interval
+        self.metrics = {}  # name -> metric, in registration order
+        self.last_sync = 0.0
+        self.sync_lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def counter(self, name, documentation, labels=()):
+        return self.metrics.setdefault(name, Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.metrics.setdefault(name, Histogram(name, documentation, labels, buckets))
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def sync(self, force=False):
+        """Write this process's numbers for the others, at most once per sync_interval"""
+        if not self.directory:
+            return
+        if not force and time.monotonic() - self.last_sync < self.sync_interval:
+            return
+        # Another thread is already writing them
+        if not self.sync_lock.acquire(blocking=False):
+            return
+        try:
+            self.last_sync = time.monotonic()
+            path = os.path.join(self.directory, f"{os.getpid()}.json")
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(path + ".tmp", path)
+        finally:
+            self.sync_lock.release()
+
+    def render(self):
+        """Return every metric in the Prometheus text format, summed over processes"""
+        snapshots = [self.snapshot()]
+        if self.directory:
+            own = f"{os.getpid()}.json"
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json") or name == own:
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    # Removed, or not fully written yet
+                    continue
+
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.expose([snapshot.get(name, []) for snapshot in snapshots]))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def reset(directory):
+        """Forget the numbers written to a directory by earlier runs"""
+        if not os.path.isdir(directory):
+            return
+        for name in os.listdir(directory):
+            if name.endswith(".json"):
+                os.remove(os.path.join(directory, name))
+
+
+class StageTimer:
+    """Adds up the time one operation spends in each of its stages
+
+    Stages may nest, as when splitting pulls pages from the extractor; time
+    is only counted for the innermost stage running. Not thread-safe: use
+    one timer per operation.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.running = []  # [stage, started] of the nested stages, innermost last
+
+    @contextmanager
+    def stage(self, name):
+        now = time.perf_counter()
+        if self.running:
+            self._stop(self.running[-1], now)
+        self.running.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self._stop(self.running.pop(), now)
+            if self.running:
+                self.running[-1][1] = now
+
+    def _stop(self, entry, now):
+        self.seconds[entry[0]] = self.seconds.get(entry[0], 0.0) + now - entry[1]
+
+    def iterate(self, name, iterable):
+        """Wrap an iterable so the time spent producing its items counts as a stage"""
+        items = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+            yield item
+
+    def observe(self, histogram):
+        """Record the time of every stage in a histogram with a stage label"""
+        for name, seconds in self.seconds.items():
+            histogram.observe(seconds, stage=name)
@@ -0,0 +1,100 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+
+# Numpy type of the stored vector components for each storage mode. There
+# is no float16 mode: numpy has no fast half-precision product, so widening
+# the vectors for every question made it slower than float32 and larger than int8.
+STORAGE_DTYPES = {"float32": np.float32, "int8": np.int8}
+
+
+def quantize(vectors, kind):
+    """Return (codes, scales) for unit-length float32 vectors
+
+    int8 quarters the size of a vector: each vector is stored as integers in
+    [-127, 127] together with one float32 scale, so the vector is
+    approximately codes * scale.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if kind == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"Unknown embedding storage: {kind}")
+
+
+def quantized_dot(codes, scales, query, block_rows=8192):
+    """Score quantized vectors against a float32 query
+
+    Rows are widened to float32 a block at a time so the product still runs
+    in BLAS while only a small block is ever held at full precision.
+    """
+    if codes.dtype == np.float32:
+        return codes @ query
+
+    scores = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), block_rows):
+        scores[start:start + block_rows] = codes[start:start + block_rows].astype(np.float32) @ query
+    if scales is not None:
+        scores *= scales
+    return scores
+
+
+def recall_report(vectors, kinds=("int8",), num_queries=200, k=10, rerank=50, seed=0):
+    """Compare quantized scoring with exact float32 search (see vector_index.recall_baseline)
+
+    Recall is reported for the quantized scores alone and after re-ranking
+    the top `rerank` candidates in float32.
+    """
+    # vector_index imports this module
+    from vector_index import recall_baseline
+
+    queries, exact_results, exact_ms = recall_baseline(vectors, num_queries, k, seed)
+    k = min(k, len(vectors))
+    rerank = min(max(k, rerank), len(vectors))
+
+    print(f"{'storage':>8} {'MB/1M rows':>11} {'recall@' + str(k):>10} "
+          f"{'reranked':>10} {'ms/query':>10}")
+    print(f"{'float32':>8} {vectors.shape[1] * 4:>11} {1.0:>10.3f} {1.0:>10.3f} {exact_ms:>10.2f}")
+
+    for kind in kinds:
+        codes, scales = quantize(vectors, kind)
+        row_bytes = codes.shape[1] * codes.itemsize + (4 if scales is not None else 0)
+
+        hits = 0
+        reranked_hits = 0
+        start = time.perf_counter()
+        for query, expected in zip(queries, exact_results):
+            scores = quantized_dot(codes, scales, query)
+            candidates = np.argpartition(-scores, rerank - 1)[:rerank]
+            hits += len(expected & set(candidates[np.argsort(-scores[candidates])[:k]].tolist()))
+
+            exact = vectors[np.sort(candidates)] @ query
+            reranked = np.sort(candidates)[np.argsort(-exact)[:k]]
+            reranked_hits += len(expected & set(reranked.tolist()))
+        ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        total = k * len(queries)
+        print(f"{kind:>8} {row_bytes:>11} {hits / total:>10.3f} {reranked_hits / total:>10.3f} {ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantized storage size and recall report for a document store")
+    parser.add_argument("store_dir", help="store directory, e.g. document_data/sentence-transformers--all-MiniLM-L6-v2")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--rerank", type=int, default=50)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    with open(os.path.join(args.store_dir, "catalog.json"), "r", encoding="utf-8") as f:
+        dim = json.load(f)["dim"]
+    from document_store import DocumentStore
+    store_vectors = DocumentStore(args.store_dir, dim).embeddings()
+    if len(store_vectors) == 0:
+        sys.exit("The store has no embeddings yet")
+    recall_report(store_vectors, num_queries=args.queries, k=args.k, rerank=args.rerank)
@@ -69,16 +69,21 @@ async function handleFileUpload() {
     return;
   }
   
-  const file = fileInput.files[0];
-  console.log('File selected:', file.name);
+  const files = Array.from(fileInput.files);
+  console.log('Files selected:', files.map(file => file.name));
   
   // Validate file type
-  if (!file.name.toLowerCase().endsWith('.pdf')) {
+  if (files.some(file => !file.name.toLowerCase().endsWith('.pdf'))) {
     uploadStatus.textContent = 'Error: Only PDF files are supported';
     console.log('Invalid file type');
     return;
   }
   
+  if (files.length > 1) {
+    return handleBatchUpload(files);
+  }
+  const file = files[0];
+  
   try {
     setLoading(true, 'Uploading document...');
     uploadStatus.textContent = 'Uploading...';
@@ -100,16 +105,21 @@ async function handleFileUpload() {
     
     const result = await response.json();
     
+    // Wait for the server to finish processing the document
+    const job = await waitForJob(result.job_id);
+    
     uploadStatus.textContent = 'Document uploaded successfully!';
     
-    // Add new document to state
-    state.documents.push({
-      id: result.doc_id,
-      filename: result.filename
-    });
+    // Add new document to state (identical uploads return an existing document)
+    if (!state.documents.some(doc => doc.id === job.doc_id)) {
+      state.documents.push({
+        id: job.doc_id,
+        filename: result.filename
+      });
+    }
     
     // Select the newly uploaded document
-    state.selectedDocIds = [result.doc_id];
+    state.selectedDocIds = [job.doc_id];
     
     // Render updated document list
     renderDocumentList();
@@ -132,6 +142,90 @@ async function handleFileUpload() {
   }
 }
 
+// Upload several files as one job and select the documents made from them
+async function handleBatchUpload(files) {
+  try {
+    setLoading(true, `Uploading ${files.length} documents...`);
+    uploadStatus.textContent = 'Uploading...';
+    
+    const formData = new FormData();
+    files.forEach(file => formData.append('files', file));
+    
+    const response = await fetch('/api/upload-documents', {
+      method: 'POST',
+      body: formData
+    });
+    
+    if (!response.ok) {
+      const errorData = await response.json();
+      throw new Error(errorData.error || 'Upload failed');
+    }
+    
+    const result = await response.json();
+    const job = await waitForJob(result.job_id);
+    
+    // Files that could not be processed have no document
+    const docIds = job.doc_ids.filter(docId => docId);
+    const failed = job.doc_ids.length - docIds.length;
+    uploadStatus.textContent = failed
+      ? `${docIds.length} documents uploaded, ${failed} could not be processed`
+      : `${docIds.length} documents uploaded successfully!`;
+    
+    // Reload the list, which now includes the new documents, and select them
+    state.selectedDocIds = Array.from(new Set(docIds));
+    await loadDocuments();
+    
+    fileInput.value = '';
+    
+    setTimeout(() => {
+      uploadStatus.textContent = '';
+    }, 3000);
+    
+    setLoading(false);
+  } catch (error) {
+    console.error('Error uploading documents:', error);
+    uploadStatus.textContent = `Error: ${error.message}`;
+    setLoading(false);
+  }
+}
+
+// Poll a document processing job until it finishes
+async function waitForJob(jobId) {
+  while (true) {
+    const response = await fetch(`/api/jobs/${jobId}`);
+    const job = await response.json();
+    
+    if (!response.ok) {
+      throw new Error(job.error || 'Could not check processing status');
+    }
+    
+    if (job.status === 'done') {
+      return job;
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.error || 'Failed to process document');
+    }
+    
+    // Show the current stage and progress
+    const progress = job.progress || {};
+    let message = 'Processing document...';
+    if (job.stage === 'extracting' && progress.total_pages) {
+      message = `Extracting text: page ${progress.pages_extracted} of ${progress.total_pages}`;
+    } else if (job.stage === 'indexing' && progress.files_total) {
+      const filesDone = progress.files_indexed + progress.files_unchanged + progress.files_deleted
+        + progress.files_failed;
+      message = `Indexing: ${filesDone} of ${progress.files_total} documents`;
+    } else if (job.stage === 'embedding') {
+      message = `Embedding: ${progress.sentences_embedded} sentences processed`;
+    } else if (job.status === 'queued') {
+      message = 'Waiting in queue...';
+    }
+    uploadStatus.textContent = message;
+    
+    await new Promise(resolve => setTimeout(resolve, 1000));
+  }
+}
+
 // Render document list
 function renderDocumentList() {
   // Clear current list
@@ -231,8 +325,8 @@ async function handleQuestionSubmit(event) {
     // Show loading indicator
     setLoading(true, 'Thinking...');
     
-    // Send question to server
-    const response = await fetch('/api/ask', {
+    // Send question to server; the answer streams back as events
+    const response = await fetch('/api/ask-stream', {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json'
@@ -248,22 +342,103 @@ async function handleQuestionSubmit(event) {
       throw new Error(errorData.error || 'Failed to get answer');
     }
     
-    const result = await response.json();
+    // Show candidate sources while the search is still running
+    let pending = null;
+    let result = null;
+    await readEvents(response, (event, data) => {
+      if (event === 'sources') {
+        if (!pending) {
+          pending = addMessage('Looking through the most relevant passages...', 'bot');
+        }
+        renderSources(pending, data);
+      } else if (event === 'answer') {
+        result = data;
+      } else if (event === 'error') {
+        throw new Error(data.error || 'Failed to get answer');
+      }
+    });
+    
+    if (pending) {
+      pending.remove();
+    }
+    if (!result) {
+      throw new Error('The answer was cut off, please try again');
+    }
     
     // Add bot message to chat
     addMessage(result.answer, 'bot', {
       confidence: result.confidence,
-      sourceDocument: result.source_document
+      sourceDocument: result.source_document,
+      sourcePage: result.source_page
     });
     
     setLoading(false);
   } catch (error) {
     console.error('Error getting answer:', error);
+    chatMessages.querySelectorAll('.pending-message').forEach(element => element.remove());
     addMessage(`Error: ${error.message}`, 'bot');
     setLoading(false);
   }
 }
 
+// Read Server-Sent Events from a fetch response, calling onEvent(event, data) for each
+async function readEvents(response, onEvent) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) {
+      break;
+    }
+    buffer += decoder.decode(value, { stream: true });
+    
+    // Events are separated by a blank line
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      
+      let event = 'message';
+      const dataLines = [];
+      frame.split('\n').forEach(line => {
+        if (line.startsWith('event:')) {
+          event = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+          dataLines.push(line.slice(5).trim());
+        }
+      });
+      if (dataLines.length > 0) {
+        onEvent(event, JSON.parse(dataLines.join('\n')));
+      }
+    }
+  }
+}
+
+// Show the best passages found so far in a placeholder message
+function renderSources(messageElement, sources) {
+  messageElement.classList.add('pending-message');
+  
+  let list = messageElement.querySelector('.source-list');
+  if (!list) {
+    list = document.createElement('ul');
+    list.className = 'source-list';
+    messageElement.appendChild(list);
+  }
+  list.innerHTML = '';
+  
+  sources.slice(0, 3).forEach(source => {
+    const item = document.createElement('li');
+    const page = source.page ? ` (page ${source.page})` : '';
+    const text = source.text.length > 160 ? `${source.text.slice(0, 160)}...` : source.text;
+    item.textContent = `${source.document}${page}: ${text}`;
+    list.appendChild(item);
+  });
+  
+  chatMessages.scrollTop = chatMessages.scrollHeight;
+}
+
 // Add message to chat
 function addMessage(text, sender, metadata = {}) {
   const messageElement = document.createElement('div');
@@ -299,7 +474,9 @@ function addMessage(text, sender, metadata = {}) {
     const confidence = metadata.confidence ? 
       `${Math.round(metadata.confidence * 100)}% confidence` : '';
     
-    sourceInfo.textContent = `Source: ${metadata.sourceDocument} ${confidence}`;
+    const page = metadata.sourcePage ? ` (page ${metadata.sourcePage})` : '';
+    
+    sourceInfo.textContent = `Source: ${metadata.sourceDocument}${page} ${confidence}`;
     messageElement.appendChild(sourceInfo);
   }
   
@@ -307,6 +484,8 @@ function addMessage(text, sender, metadata = {}) {
   
   // Scroll to bottom
   chatMessages.scrollTop = chatMessages.scrollHeight;
+  
+  return messageElement;
 }
 
 // Set loading state
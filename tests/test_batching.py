@@ -0,0 +1,45 @@
+import threading
+import numpy as np
+import pytest
+
+from batching import EmbeddingBatcher
+
+
+def encode_batch(texts):
+    """Embeds a text as its number, so every result shows which request it belongs to"""
+    return np.array([[float(text), -float(text)] for text in texts], dtype=np.float32)
+
+
+def test_every_caller_gets_its_own_embedding():
+    batcher = EmbeddingBatcher(encode_batch, max_batch_size=8, max_wait_ms=20)
+    results = {}
+    start = threading.Barrier(32)
+
+    def ask(i):
+        start.wait()
+        results[i] = batcher.encode(str(i))
+
+    threads = [threading.Thread(target=ask, args=(i,)) for i in range(32)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == list(range(32))
+    for i, embedding in results.items():
+        assert embedding.tolist() == [i, -i]
+    stats = batcher.stats()
+    assert stats["requests"] == 32
+    assert stats["batches"] < 32
+
+
+def test_a_failed_batch_is_raised_to_its_callers():
+    def fail(texts):
+        raise RuntimeError("encoder failed")
+
+    batcher = EmbeddingBatcher(fail)
+    with pytest.raises(RuntimeError, match="encoder failed"):
+        batcher.encode("1")
+    # The batching thread survives and serves the next request
+    batcher.encode_batch = encode_batch
+    assert batcher.encode("2").tolist() == [2, -2]
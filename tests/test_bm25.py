@@ -0,0 +1,62 @@
+import numpy as np
+from bm25 import BM25Index
+
+
+DOCUMENTS = [
+    ["The module code is COMP3001.", "Lectures are on Monday.", "Coursework counts for half."],
+    ["Portfolio returns are estimated.", "The estimator shrinks the mean."],
+    ["Lectures move to Tuesday in week 5.", "Ask about the coursework in office hours.", "Café opens at 9."],
+]
+
+
+def build(documents, start=0):
+    index = BM25Index()
+    for sentences in documents:
+        document = BM25Index()
+        document.add(sentences)
+        index.extend(document, start)
+        start += len(sentences)
+    return index
+
+
+def assert_same_scores(index, expected):
+    for query in ["lectures coursework", "COMP3001", "estimator mean", "café", "unknown words"]:
+        rows, scores = index.scores(query)
+        expected_rows, expected_scores = expected.scores(query)
+        np.testing.assert_array_equal(rows, expected_rows)
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-6)
+
+
+def test_saved_index_scores_like_the_one_in_memory(tmp_path):
+    index = build(DOCUMENTS)
+    index.save(tmp_path)
+
+    opened = BM25Index.open(tmp_path)
+    assert len(opened) == len(index)
+    assert_same_scores(opened, index)
+
+
+def test_saving_again_appends_and_reuses_mapped_segments(tmp_path):
+    index = build(DOCUMENTS[:2])
+    index.save(tmp_path)
+    opened = BM25Index.open(tmp_path)
+
+    # Another process extends the saved index, leaving a gap of two rows
+    writer = BM25Index.open(tmp_path)
+    document = BM25Index()
+    document.add(DOCUMENTS[2])
+    writer.extend(document, len(writer) + 2)
+    writer.save(tmp_path)
+
+    reopened = BM25Index.open(tmp_path, previous=opened)
+    expected = build(DOCUMENTS[:2])
+    expected.extend(document, len(expected) + 2)
+    assert len(reopened) == len(expected)
+    assert_same_scores(reopened, expected)
+    kept = {segment.file for segment in opened.segments} & {segment.file for segment in reopened.segments}
+    assert all(segment in opened.segments for segment in reopened.segments if segment.file in kept)
+    assert sorted(path.name for path in tmp_path.glob("*.seg")) == sorted(segment.file for segment in reopened.segments)
+
+
+def test_open_without_a_saved_index(tmp_path):
+    assert BM25Index.open(tmp_path) is None
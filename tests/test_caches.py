@@ -0,0 +1,26 @@
+from caches import ResidencyTracker
+
+
+def test_residency_stays_within_budget():
+    tracker = ResidencyTracker(budget=100)
+    for doc_id in "abcd":
+        tracker.add(doc_id, 40)
+
+    assert tracker.use(["a", "b"]) == (["a", "b"], [])
+    loaded, evicted = tracker.use(["c", "d"])
+    assert (loaded, evicted) == (["c", "d"], ["a", "b"])
+    assert tracker.resident_bytes <= tracker.budget
+
+    tracker.use(["a"])
+    assert list(tracker.resident) == ["d", "a"]
+    assert tracker.stats()["reloads"] == 1
+
+
+def test_residency_keeps_a_document_larger_than_the_budget():
+    tracker = ResidencyTracker(budget=100)
+    tracker.add("small", 40)
+    tracker.add("large", 150)
+
+    tracker.use(["small"])
+    assert tracker.use(["large"]) == (["large"], ["small"])
+    assert list(tracker.resident) == ["large"]
@@ -0,0 +1,43 @@
+import pytest
+
+from chunking import TokenChunker
+
+
+class WhitespaceTokenizer:
+    """Stands in for the model's tokenizer: one token per word"""
+
+    def __call__(self, texts, **kwargs):
+        return {"input_ids": [text.split() for text in texts]}
+
+
+def segments(lengths):
+    """(sentence, page_number) pairs of the given word counts, four sentences a page"""
+    return [(" ".join(["word"] * length) + f" s{i}.", i // 4 + 1) for i, length in enumerate(lengths)]
+
+
+@pytest.mark.parametrize("overlap", [0, 1, 2])
+def test_chunks_cover_the_sentences_in_order(overlap):
+    document = segments([3, 5, 10, 2, 30, 4, 1, 7, 7, 7, 2, 9, 12, 1])
+    chunker = TokenChunker(WhitespaceTokenizer(), max_tokens=20, overlap=overlap, batch_size=3)
+    chunks = list(chunker.iter_chunks(document))
+
+    for sentences, first, page in chunks:
+        # Each chunk is the run of sentences its span says, starting on the page of its first sentence
+        assert sentences == [sentence for sentence, _ in document[first:first + len(sentences)]]
+        assert page == document[first][1]
+        # Only a sentence longer than the budget on its own makes a chunk too long
+        tokens = sum(len(sentence.split()) for sentence in sentences)
+        assert tokens <= chunker.budget or len(sentences) == 1
+
+    # Consecutive chunks start later, share at most `overlap` sentences and leave no gaps
+    spans = [(first, first + len(sentences)) for sentences, first, _ in chunks]
+    assert spans[0][0] == 0 and spans[-1][1] == len(document)
+    for (first, end), (next_first, next_end) in zip(spans, spans[1:]):
+        assert first < next_first <= end <= next_end
+        assert end - next_first <= overlap
+
+
+def test_overlap_is_dropped_when_it_leaves_no_room():
+    document = segments([4, 4, 15])
+    chunks = list(TokenChunker(WhitespaceTokenizer(), max_tokens=20, overlap=1).iter_chunks(document))
+    assert [(len(sentences), first) for sentences, first, _ in chunks] == [(2, 0), (1, 2)]
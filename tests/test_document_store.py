@@ -0,0 +1,24 @@
+from document_store import SentenceBuffer
+
+
+def test_sentence_buffer_round_trip(tmp_path):
+    sentences = ["First sentence.", "Ünïcödé — 文字 too!", "", "Last one?"]
+    path = str(tmp_path / "doc.bin")
+    SentenceBuffer.write(path, sentences)
+
+    buffer = SentenceBuffer.open(path)
+    assert len(buffer) == len(sentences)
+    assert list(buffer) == sentences
+    assert buffer[1] == sentences[1] and buffer[-1] == sentences[-1]
+    assert buffer.text(0, 2) == " ".join(sentences[:2])
+    assert buffer.text(1, 4) == " ".join(sentences[1:])
+    # Out-of-range spans are clipped rather than failing
+    assert buffer.text(-3, 99) == " ".join(sentences)
+    assert buffer.text(3, 3) == ""
+
+
+def test_empty_sentence_buffer(tmp_path):
+    path = str(tmp_path / "empty.bin")
+    SentenceBuffer.write(path, [])
+    buffer = SentenceBuffer.open(path)
+    assert len(buffer) == 0 and list(buffer) == [] and buffer.text(0, 1) == ""
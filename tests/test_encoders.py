@@ -0,0 +1,58 @@
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from transformers import AutoModel, AutoTokenizer
+
+from encoders import BACKENDS, SAMPLE_SENTENCES, load_encoder
+
+MIN_COSINE = 0.99
+
+
+@pytest.fixture(scope="module")
+def model_name():
+    """The model the chatbot runs, if it is already downloaded; the tests don't fetch it"""
+    name = os.environ.get("MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
+    try:
+        AutoTokenizer.from_pretrained(name, local_files_only=True)
+        AutoModel.from_pretrained(name, local_files_only=True)
+    except Exception as e:
+        pytest.skip(f"model {name} is not available: {e}")
+    return name
+
+
+def cosines(a, b):
+    return np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+
+@pytest.mark.parametrize("backend", [backend for backend in BACKENDS if backend != "eager"])
+def test_backend_matches_eager(model_name, backend, tmp_path):
+    tokenizer = AutoTokenizer.from_pretrained(model_name, local_files_only=True)
+    batch = tokenizer(SAMPLE_SENTENCES, padding=True, truncation=True, max_length=512, return_tensors="pt")
+
+    def encode(name):
+        model = AutoModel.from_pretrained(model_name, local_files_only=True)
+        encoder = load_encoder(name, model, tokenizer, str(tmp_path / "encoder.onnx"))
+        if encoder.backend != name:
+            pytest.skip(f"the {name} encoder can't be set up here")
+        return encoder(batch["input_ids"], batch["attention_mask"])
+
+    assert cosines(encode(backend), encode("eager")).min() >= MIN_COSINE
+
+
+def test_batched_embeddings_match_single(model_name, tmp_path, monkeypatch):
+    import chatbot
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("MODEL_NAME", model_name)
+    monkeypatch.setenv("MODEL_LOADING", "lazy")
+    monkeypatch.setenv("CORPUS_REFRESH_INTERVAL", "0")
+    bot = chatbot.DocumentChatbot()
+    assert bot.model_name == model_name
+
+    # Texts of very different lengths, so batches pad most of them
+    texts = SAMPLE_SENTENCES + [" ".join(SAMPLE_SENTENCES)]
+    assert chatbot.embedding_parity(bot, texts, batch_size=8).min() >= MIN_COSINE
@@ -0,0 +1,95 @@
+import re
+import hashlib
+from types import SimpleNamespace
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+import chatbot
+from benchmark import write_pdf
+
+
+class WhitespaceTokenizer:
+    """Stands in for the model's tokenizer: one token per word"""
+
+    def __call__(self, texts, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        return {"input_ids": [text.split() for text in texts]}
+
+
+def hashed_embeddings(texts, dim):
+    """Bag-of-words vectors, so texts sharing words get similar embeddings"""
+    embeddings = np.zeros((len(texts), dim), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for word in re.findall(r"\w+", text.lower()):
+            seed = int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % 2**32
+            embeddings[i] += np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return embeddings
+
+
+@pytest.fixture
+def make_chatbot(tmp_path, monkeypatch):
+    """Return a factory of chatbots working in an empty directory, without downloading a model"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("MODEL_LOADING", "lazy")
+    monkeypatch.setenv("CORPUS_REFRESH_INTERVAL", "0")
+    monkeypatch.setattr(chatbot, "AutoTokenizer", SimpleNamespace(from_pretrained=lambda name: WhitespaceTokenizer()))
+    monkeypatch.setattr(chatbot, "AutoConfig", SimpleNamespace(from_pretrained=lambda name: SimpleNamespace(hidden_size=32)))
+    monkeypatch.setattr(chatbot.DocumentChatbot, "generate_embeddings",
+                        lambda self, texts, batch_size=None, progress=None: hashed_embeddings(texts, self.embedding_dim))
+    return chatbot.DocumentChatbot
+
+
+def test_sentences_carry_over_page_breaks():
+    pages = ["Intro line. This sentence runs", "", "over two pages. Page three", "ends here! Last words"]
+    assert list(chatbot.SimpleTokenizer.iter_sentences(pages)) == [
+        ("Intro line.", 1),
+        ("This sentence runs over two pages.", 1),
+        ("Page three ends here!", 3),
+        ("Last words.", 4),
+    ]
+
+
+def test_text_without_sentence_boundaries_is_not_carried_forever():
+    words = " ".join(["word"] * 400)
+    segments = list(chatbot.SimpleTokenizer.iter_sentences([words, words]))
+    assert all(len(sentence) <= chatbot.SimpleTokenizer.MAX_SENTENCE_LENGTH + 1 for sentence, _ in segments)
+    assert {page for _, page in segments} == {1, 2}
+    assert sum(len(sentence.split()) for sentence, _ in segments) == 800
+
+
+def write_uploads():
+    write_pdf("uploads/apples.pdf", ["Apples grow on trees in the orchard. They are picked in autumn. " * 4])
+    write_pdf("uploads/rivers.pdf", ["Rivers carry water to the sea. Their banks flood in spring. " * 4])
+    return chatbot.find_pdfs("uploads")
+
+
+def test_deleted_document_is_not_ingested_again(make_chatbot):
+    bot = make_chatbot()
+    paths = write_uploads()
+    apples, rivers = bot.ingest_files(paths)
+    assert apples and rivers
+
+    assert bot.delete_document(apples)
+
+    # A server start ingests the upload folder again, in this process or a new one
+    assert bot.ingest_files(paths) == [None, rivers]
+    assert make_chatbot().ingest_files(paths) == [None, rivers]
+    bot.refresh(force=True)
+    assert list(bot.documents) == [rivers]
+    assert all(match[0] == rivers for match in bot.search("apples orchard", hashed_embeddings(
+        ["apples orchard"], bot.embedding_dim)[0], k=10))
+
+
+def test_uploading_a_deleted_document_again_restores_it(make_chatbot):
+    bot = make_chatbot()
+    paths = write_uploads()
+    apples, _ = bot.ingest_files(paths)
+    bot.delete_document(apples)
+
+    restored = bot.ingest_files(paths[:1], skip_deleted=False)[0]
+    assert restored in bot.documents
+    assert bot.ingest_files(paths)[0] == restored
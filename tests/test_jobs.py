@@ -0,0 +1,34 @@
+from jobs import IngestionQueue
+
+
+class StubChatbot:
+    """Indexes files by content, as the chatbot does, without a model"""
+
+    def __init__(self):
+        self.documents = {}
+
+    def process_document(self, file_path, filename=None, progress=None):
+        with open(file_path, "rb") as f:
+            doc_id = f.read().decode("utf-8")
+        self.documents.setdefault(doc_id, {"id": doc_id, "filename": filename, "path": file_path})
+        return doc_id
+
+    def ingest_files(self, file_paths, filenames=None, progress=None, skip_deleted=True):
+        return [self.process_document(file_path) for file_path in file_paths]
+
+
+def test_uploads_of_an_indexed_document_are_removed(tmp_path):
+    paths = []
+    for name, content in [("first.pdf", "apples"), ("copy.pdf", "apples"), ("other.pdf", "rivers")]:
+        paths.append(tmp_path / name)
+        paths[-1].write_text(content)
+
+    jobs = IngestionQueue(StubChatbot())
+    first = jobs.submit(str(paths[0]), "first.pdf")
+    jobs.pending.join()
+    batch = jobs.submit_batch([str(paths[1]), str(paths[2])], ["copy.pdf", "other.pdf"])
+    jobs.pending.join()
+
+    assert jobs.get(first)["doc_id"] == "apples"
+    assert jobs.get(batch)["doc_ids"] == ["apples", "rivers"]
+    assert [path.exists() for path in paths] == [True, False, True]
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from ann_index import IVFIndex
+from quantization import quantize
+from vector_index import VectorIndex, normalize_rows, recall_baseline
+
+
+@pytest.fixture
+def vectors():
+    """Unit vectors around a few dozen centres, like sentences on a handful of topics"""
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((40, 32))
+    return normalize_rows(centres[rng.integers(0, 40, 3000)] + 0.3 * rng.standard_normal((3000, 32)))
+
+
+def make_index(vectors, **kwargs):
+    index = VectorIndex(vectors.shape[1], **kwargs)
+    index.attach(vectors)
+    for doc_id, start in zip("abc", range(0, len(vectors), 1000)):
+        index.add_document(doc_id, start, 1000)
+    return index
+
+
+def brute_force(vectors, query, k, rows):
+    scores = vectors[rows] @ normalize_rows(query)
+    order = np.argsort(-scores)[:k]
+    return rows[order], scores[order]
+
+
+@pytest.mark.parametrize("doc_ids", [None, ["a"], ["a", "c"], ["b", "c"]])
+def test_search_rows_matches_brute_force(vectors, doc_ids):
+    index = make_index(vectors)
+    index.remove_document("b")
+    live = [doc_id for doc_id in doc_ids or "abc" if doc_id in index.doc_ranges]
+    rows = np.concatenate([np.arange(*index.doc_ranges[doc_id]) for doc_id in live])
+
+    for query in np.random.default_rng(1).standard_normal((5, 32)):
+        found, similarities = index.search_rows(query, k=10, doc_ids=doc_ids)
+        expected, scores = brute_force(vectors, query, 10, rows)
+        assert found.tolist() == expected.tolist()
+        np.testing.assert_allclose(similarities, scores, rtol=1e-5)
+
+
+def test_iter_search_rows_ends_with_search_rows(vectors):
+    index = make_index(vectors)
+    index.remove_document("b")
+
+    for query in np.random.default_rng(2).standard_normal((5, 32)):
+        results = list(index.iter_search_rows(query, k=10, block_rows=256))
+        assert len(results) == 8  # two live documents of four blocks each
+        found, similarities = results[-1]
+        expected, scores = index.search_rows(query, k=10)
+        assert found.tolist() == expected.tolist()
+        np.testing.assert_allclose(similarities, scores, rtol=1e-5)
+        # The k-th best match only gets better as more blocks are scored
+        assert np.all(np.diff([result[1][-1] for result in results]) >= 0)
+
+
+def test_int8_scores_are_reranked_to_float32(vectors):
+    exact = make_index(vectors)
+    index = make_index(vectors, rerank=50)
+    index.attach(vectors, *quantize(vectors, "int8"))
+
+    for query in np.random.default_rng(3).standard_normal((20, 32)):
+        found, similarities = index.search_rows(query, k=10)
+        expected, _ = exact.search_rows(query, k=10)
+        assert found.tolist() == expected.tolist()
+        np.testing.assert_allclose(similarities, vectors[found] @ normalize_rows(query), rtol=1e-6)
+        streamed, streamed_similarities = list(index.iter_search_rows(query, k=10, block_rows=256))[-1]
+        assert streamed.tolist() == found.tolist()
+        np.testing.assert_allclose(streamed_similarities, similarities, rtol=1e-5)
+
+
+def test_ivf_recall(vectors):
+    index = make_index(vectors, ann=IVFIndex(32, nlist=40, nprobe=8), ann_min_rows=0)
+    assert index.update_ann()
+    queries, exact_results, _ = recall_baseline(vectors, num_queries=100, k=10)
+
+    recall = np.mean([len(set(index.search_rows(query, k=10)[0].tolist()) & exact) / 10
+                      for query, exact in zip(queries, exact_results)])
+    assert recall >= 0.9
+
+
+def test_ivf_save_and_load(vectors, tmp_path):
+    ann = IVFIndex(32, nlist=40)
+    ann.train(vectors)
+    ann.add(vectors, 0)
+    path = str(tmp_path / "ann_ivf.npz")
+    ann.save(path)
+
+    loaded = IVFIndex.load(path)
+    assert (loaded.num_rows, loaded.trained_rows, loaded.nlist) == (ann.num_rows, ann.trained_rows, ann.nlist)
+    for query in vectors[:10]:
+        assert loaded.candidates(query).tolist() == ann.candidates(query).tolist()
+
+    (tmp_path / "ann_ivf.npz").write_bytes(b"damaged")
+    assert IVFIndex.load(path) is None
@@ -0,0 +1,281 @@
+import time
+import heapq
+import logging
+import numpy as np
+from quantization import quantized_dot
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_rows(matrix):
+    """Scale each row to unit length, leaving all-zero rows untouched"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def recall_baseline(vectors, num_queries=200, k=10, seed=0):
+    """Return (queries, exact top-k row sets, exact ms/query) to measure approximate search against
+
+    Queries are stored vectors with a little noise added, so every query has
+    realistic near neighbours in the corpus. Shared by the recall reports of
+    ann_index.py and quantization.py.
+    """
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(len(vectors), min(num_queries, len(vectors)), replace=False)
+    queries = np.asarray(vectors[query_rows], dtype=np.float32)
+    queries = normalize_rows(queries + rng.normal(0, 0.05, queries.shape).astype(np.float32))
+    k = min(k, len(vectors))
+
+    exact_results = []
+    start = time.perf_counter()
+    for query in queries:
+        scores = vectors @ query
+        exact_results.append(set(np.argpartition(-scores, k - 1)[:k].tolist()))
+    return queries, exact_results, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+class VectorIndex:
+    """Corpus-wide index over pre-normalized sentence vectors
+
+    Every sentence vector lives in one contiguous (rows, dim) array, with the
+    rows of each document kept together. Because the vectors are unit length,
+    cosine similarity for a query is a single matrix-vector product.
+
+    Removed documents leave their rows behind in the array; those rows no
+    longer belong to any document and are never returned.
+
+    An optional approximate index (see ann_index.IVFIndex) can narrow each
+    query down to a candidate set once the corpus has at least
+    `ann_min_rows` vectors; smaller corpora are always searched exactly.
+
+    If a quantized copy of the vectors is attached (see quantization.py),
+    queries are scored on it instead, and the best `rerank` candidates are
+    rescored with the float32 vectors so the reported similarities are exact.
+    """
+
+    def __init__(self, dim, ann=None, ann_min_rows=50000, rerank=50):
+        self.dim = dim
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.quantized = (None, None)  # (codes, scales) scored in place of vectors
+        self.rerank = rerank
+        self.doc_ranges = {}  # doc_id -> (start_row, end_row)
+        self.doc_order = []  # doc ordinal -> doc_id (None once removed)
+        self.doc_ordinals = {}  # doc_id -> doc ordinal
+        self.row_doc = np.zeros(0, dtype=np.int32)  # row -> doc ordinal, -1 if none
+        self.live_rows = 0  # rows that belong to a document
+        self.ann = ann
+        self.ann_min_rows = ann_min_rows
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def attach(self, vectors, codes=None, scales=None):
+        """Point the index at a (possibly larger) vector array and its quantized copy"""
+        # The quantized copy goes first: scoring never reads past len(self.vectors)
+        self.quantized = (codes, scales)
+        self.vectors = vectors
+
+    def _dot(self, query, selector):
+        """Score the rows picked by a slice or row array, quantized if possible"""
+        codes, scales = self.quantized
+        if codes is None:
+            return self.vectors[selector] @ query
+        return quantized_dot(codes[selector], None if scales is None else scales[selector], query)
+
+    def add_document(self, doc_id, start, count):
+        """Register the rows [start, start + count) as belonging to doc_id"""
+        ordinal = len(self.doc_order)
+        self.doc_order.append(doc_id)
+        self.doc_ordinals[doc_id] = ordinal
+        self.doc_ranges[doc_id] = (start, start + count)
+
+        if len(self.row_doc) < start + count:
+            row_doc = np.full(start + count, -1, dtype=np.int32)
+            row_doc[:len(self.row_doc)] = self.row_doc
+            self.row_doc = row_doc
+        self.row_doc[start:start + count] = ordinal
+        self.live_rows += count
+
+    def remove_document(self, doc_id):
+        """Stop returning a document's rows"""
+        start, end = self.doc_ranges.pop(doc_id)
+        self.doc_order[self.doc_ordinals.pop(doc_id)] = None
+        self.row_doc[start:end] = -1
+        self.live_rows -= end - start
+
+    def update_ann(self):
+        """Train the ANN index or add rows it hasn't seen; returns True if it changed"""
+        if self.ann is None or len(self.vectors) < self.ann_min_rows:
+            return False
+
+        rows = len(self.vectors)
+        if not self.ann.trained or self.ann.num_rows > rows or rows > 4 * self.ann.trained_rows:
+            # (Re)train once the corpus has grown well past the last training set.
+            # A fresh index is built and swapped in so searches never see it half done.
+            logger.info("Training ANN index on %d vectors...", rows)
+            ann = type(self.ann)(self.dim, nlist=self.ann.nlist, nprobe=self.ann.nprobe)
+            ann.train(self.vectors)
+            ann.add(self.vectors, 0)
+            self.ann = ann
+            return True
+
+        if self.ann.num_rows < rows:
+            self.ann.add(self.vectors[self.ann.num_rows:], self.ann.num_rows)
+            return True
+        return False
+
+    def _ann_ready(self):
+        """Whether queries currently go through the ANN index"""
+        ann = self.ann
+        return (ann is not None and ann.trained and len(self.vectors) >= self.ann_min_rows
+                and ann.num_rows == len(self.vectors))
+
+    def _ann_score(self, query, doc_ids, k):
+        """Score only the ANN candidates, or return None to fall back to exact search"""
+        if not self._ann_ready():
+            return None
+
+        rows = self.select_rows(self.ann.candidates(query), doc_ids)
+        if len(rows) < k:
+            return None
+        return self._dot(query, rows), rows
+
+    def _score(self, query, doc_ids):
+        """Return (scores, rows) for the rows selected by doc_ids"""
+        if doc_ids is None:
+            scores = self._dot(query, slice(0, len(self.vectors)))
+            if self.live_rows < len(scores):
+                # Skip rows of removed documents (and any not registered yet)
+                known = min(len(scores), len(self.row_doc))
+                dead = np.ones(len(scores), dtype=bool)
+                dead[:known] = self.row_doc[:known] < 0
+                scores[dead] = -np.inf
+            return scores, None
+
+        ranges = [self.doc_ranges[doc_id] for doc_id in doc_ids if doc_id in self.doc_ranges]
+        if not ranges:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+        selected = sum(end - start for start, end in ranges)
+        if selected * 2 >= len(self.vectors):
+            # Most of the corpus is selected: score everything, mask the rest
+            scores = self._dot(query, slice(0, len(self.vectors)))
+            mask = np.ones(len(scores), dtype=bool)
+            for start, end in ranges:
+                mask[start:end] = False
+            scores[mask] = -np.inf
+            return scores, None
+
+        # Only score the selected documents' rows
+        scores = np.concatenate([self._dot(query, slice(start, end)) for start, end in ranges])
+        rows = np.concatenate([np.arange(start, end) for start, end in ranges])
+        return scores, rows
+
+    def select_rows(self, rows, doc_ids=None):
+        """Keep the rows that are searchable and belong to one of doc_ids (None = all)"""
+        rows = rows[rows < min(len(self.vectors), len(self.row_doc))]
+        rows = rows[self.row_doc[rows] >= 0]
+        if doc_ids is not None:
+            ordinals = [self.doc_ordinals[doc_id] for doc_id in doc_ids if doc_id in self.doc_ordinals]
+            rows = rows[np.isin(self.row_doc[rows], ordinals)]
+        return rows
+
+    def score_rows(self, query, rows):
+        """Return the cosine similarity of the query to each of the given rows"""
+        return self.vectors[rows] @ normalize_rows(query)
+
+    def search_rows(self, query, k=10, doc_ids=None, rows=None):
+        """Return (rows, similarities) of the top-k matches, best first
+
+        If rows (sorted row ids) is given, only those rows are scored.
+        """
+        empty = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if len(self.vectors) == 0 or k <= 0:
+            return empty
+
+        query = normalize_rows(query)
+        if rows is not None:
+            rows = self.select_rows(rows, doc_ids)
+            scored = self._dot(query, rows), rows
+        else:
+            scored = self._ann_score(query, doc_ids, k)
+        scores, rows = scored if scored is not None else self._score(query, doc_ids)
+        if len(scores) == 0:
+            return empty
+
+        k = min(k, len(scores))
+        rerank = self.quantized[0] is not None and self.rerank > 0
+        candidates = min(max(k, self.rerank), len(scores)) if rerank else k
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        top = top[scores[top] > -np.inf]
+        top_rows, similarities = (top if rows is None else rows[top]), scores[top]
+
+        if rerank:
+            similarities = self.vectors[top_rows] @ query
+        order = np.argsort(-similarities)[:k]
+        return top_rows[order], similarities[order]
+
+    def iter_search_rows(self, query, k=10, doc_ids=None, block_rows=16384):
+        """Yield (rows, similarities) of the top-k matches among the rows scored so far
+
+        Rows are scored a block at a time and only the best are kept, in a
+        bounded heap, so callers can show matches before the whole selection
+        is scored. The last result is what search_rows() returns.
+        """
+        if len(self.vectors) == 0 or k <= 0 or self._ann_ready():
+            yield self.search_rows(query, k, doc_ids)
+            return
+
+        if doc_ids is None and self.live_rows >= len(self.vectors):
+            ranges = [(0, len(self.vectors))]
+        elif doc_ids is None:
+            ranges = sorted(self.doc_ranges.values())
+        else:
+            ranges = sorted(self.doc_ranges[doc_id] for doc_id in doc_ids if doc_id in self.doc_ranges)
+        blocks = [(start, min(start + block_rows, end))
+                  for range_start, end in ranges for start in range(range_start, end, block_rows)]
+        if not blocks:
+            yield self.search_rows(query, k, doc_ids)
+            return
+
+        query = normalize_rows(query)
+        rerank = self.quantized[0] is not None and self.rerank > 0
+        candidates = max(k, self.rerank) if rerank else k
+        heap = []  # (score, row) of the best rows so far, worst first
+        for start, end in blocks:
+            scores = self._dot(query, slice(start, end))
+            if len(scores) > candidates:
+                top = np.argpartition(-scores, candidates - 1)[:candidates]
+            else:
+                top = np.arange(len(scores))
+            for score, row in zip(scores[top].tolist(), (top + start).tolist()):
+                if len(heap) < candidates:
+                    heapq.heappush(heap, (score, row))
+                elif score > heap[0][0]:
+                    heapq.heapreplace(heap, (score, row))
+
+            top_rows = np.array([row for _, row in heap], dtype=np.int64)
+            similarities = np.array([score for score, _ in heap], dtype=np.float32)
+            if rerank:
+                similarities = self.vectors[top_rows] @ query
+            order = np.argsort(-similarities)[:k]
+            yield top_rows[order], similarities[order]
+
+    def locate(self, rows, similarities):
+        """Turn row ids into (doc_id, sentence_idx, similarity) matches"""
+        matches = []
+        for row, similarity in zip(rows, similarities):
+            ordinal = self.row_doc[row]
+            if ordinal < 0:
+                # Removed while the search was running
+                continue
+            doc_id = self.doc_order[ordinal]
+            matches.append((doc_id, int(row - self.doc_ranges[doc_id][0]), float(similarity)))
+        return matches
+
+    def search(self, query, k=10, doc_ids=None, rows=None):
+        """Return the top-k (doc_id, sentence_idx, similarity) matches, best first"""
+        return self.locate(*self.search_rows(query, k, doc_ids, rows))